@@ -0,0 +1,180 @@
+import asyncio
+import threading
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result
+from instrumentation import tracer
+from wpcommandrunner import SQL_COMMAND, get_command_type, get_sql_rows
+
+try:
+    import asyncssh
+except ImportError:  # asyncssh is only needed for the asyncssh backend
+    asyncssh = None
+
+
+class AsyncWPCommandRunner:
+    """
+    asyncio version of WPCommandRunner on top of asyncssh.
+
+    All commands are channels on one SSH connection, and up to
+    max_concurrency of them run at the same time, so callers can pipeline
+    lookups, uploads and meta updates with asyncio.gather instead of waiting
+    for each round trip. connect_kwargs are passed to asyncssh.connect, e.g.
+    client_keys or known_hosts=None to test against a local sshd or an
+    in-process asyncssh server.
+    """
+
+    def __init__(
+        self,
+        host,
+        user,
+        port=22,
+        wp_path="/home/ubuntu/wordpress",
+        max_concurrency=8,
+        connect_kwargs=None,
+    ):
+        if asyncssh is None:
+            raise RuntimeError(
+                "The asyncssh backend needs asyncssh, install it with `pip install asyncssh`."
+            )
+        self.host = host
+        self.user = user
+        self.port = port
+        self.wp_path = wp_path
+        self.max_concurrency = max_concurrency
+        self.connect_kwargs = connect_kwargs or {}
+        self.connection = None
+        self.sftp = None
+        self.semaphore = None
+        self.sftp_lock = None
+        self.counters = {"commands": 0, "uploads": 0}
+
+    async def connect(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.sftp_lock = asyncio.Lock()
+        self.connection = await asyncssh.connect(
+            self.host, port=self.port, username=self.user, **self.connect_kwargs
+        )
+        return self
+
+    async def run_command(self, command, stdin=None):
+        if isinstance(stdin, str):
+            stdin = stdin.encode("utf-8")
+        async with self.semaphore:
+            self.counters["commands"] += 1
+            if stdin is None:
+                # Close stdin right away, like the fabric runner does, so a
+                # command that reads it does not wait forever
+                result = await self.connection.run(
+                    command, stdin=asyncssh.DEVNULL, encoding=None, check=False
+                )
+            else:
+                result = await self.connection.run(
+                    command, input=stdin, encoding=None, check=False
+                )
+        stdout = (result.stdout or b"").decode("utf-8", errors="replace")
+        stderr = (result.stderr or b"").decode("utf-8", errors="replace")
+        if result.exit_status != 0:
+            # Fail the same way the fabric runner does
+            raise UnexpectedExit(
+                Result(
+                    stdout=stdout,
+                    stderr=stderr,
+                    command=command,
+                    exited=result.exit_status,
+                    hide=("stdout", "stderr"),
+                )
+            )
+        return stdout.strip()
+
+    async def run_wp_cli(self, command, stdin=None):
+        # Run the command from the WordPress installation directory or
+        # wp cli will not work.
+        return await self.run_command(f"cd {self.wp_path} && {command}", stdin)
+
+    async def put(self, local, remote_path):
+        """Upload a local path or file-like object over one shared SFTP client."""
+        async with self.sftp_lock:
+            if self.sftp is None:
+                self.sftp = await self.connection.start_sftp_client()
+            if hasattr(local, "read"):
+                async with self.sftp.open(remote_path, "wb") as remote_file:
+                    await remote_file.write(local.read())
+            else:
+                await self.sftp.put(local, remote_path)
+            self.counters["uploads"] += 1
+
+    def stats(self):
+        return dict(self.counters)
+
+    async def close(self):
+        if self.sftp is not None:
+            self.sftp.exit()
+            self.sftp = None
+        if self.connection is not None:
+            self.connection.close()
+            await self.connection.wait_closed()
+            self.connection = None
+
+
+class BlockingWPCommandRunner:
+    """
+    WPCommandRunner interface for code running outside the event loop.
+
+    Each call is scheduled on the loop that owns the AsyncWPCommandRunner
+    and waited for, so the existing synchronous code (SectorManager,
+    WPImageCreator, ExpertSectionCreator) can share the async connection
+    from worker threads.
+    """
+
+    def __init__(self, async_runner, loop):
+        self.async_runner = async_runner
+        self.loop = loop
+
+    def call(self, coroutine):
+        if self.is_loop_thread():
+            # Waiting here would block the loop that has to run the call
+            coroutine.close()
+            raise RuntimeError(
+                "BlockingWPCommandRunner called on its event loop, use asyncio.to_thread"
+            )
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def is_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def run_command(self, command, stdin=None):
+        # Spans are recorded here, in the calling thread, so that they are
+        # nested under the page that is being synced
+        with tracer.span("remote", command_type=get_command_type(command)) as span:
+            stdout = self.call(self.async_runner.run_command(command, stdin))
+            span["stdout_bytes"] = len(stdout)
+            return stdout
+
+    def run_wp_cli(self, command, stdin=None):
+        with tracer.span("remote", command_type=get_command_type(command)) as span:
+            stdout = self.call(self.async_runner.run_wp_cli(command, stdin))
+            span["stdout_bytes"] = len(stdout)
+            return stdout
+
+    def run_sql_rows(self, sql):
+        return get_sql_rows(self.run_wp_cli(SQL_COMMAND, stdin=sql.encode("utf-8")))
+
+    def put(self, local, remote_path):
+        with tracer.span("remote", command_type="put"):
+            return self.call(self.async_runner.put(local, remote_path))
+
+    def stats(self):
+        return self.async_runner.stats()
+
+    def close(self):
+        self.call(self.async_runner.close())
+
+
+def start_event_loop():
+    """Run a new event loop in a daemon thread and return it."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
@@ -0,0 +1,326 @@
+"""
+Benchmark the full sector sync on synthetic data.
+
+For every scale a sector CSV and data tree are generated in a temporary
+directory, and SectorManager.create_sector_pages is run against the fake
+WordPress backend (or a real one with --backend fabric). The results are
+printed as JSON, and written to --output, so runs can be compared:
+
+    python benchmarks/sectorsyncbenchmark.py --pages 40,400,4000 --latency 0.05
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+
+from invoke.exceptions import UnexpectedExit  # noqa: E402
+from slugify import slugify  # noqa: E402
+from fakewprunner import FakeWPCommandRunner, make_template  # noqa: E402
+from jsonupdator import JSONUpdator  # noqa: E402
+from sectorpagecreator import SectorManager  # noqa: E402
+from syntheticsectordata import generate_sector_data  # noqa: E402
+from wpcommandrunner import (  # noqa: E402
+    SQL_COMMAND,
+    WPCommandRunner,
+    get_command_type,
+    get_sql_rows,
+)
+from wpimagecreator import WPImageCreator  # noqa: E402
+
+# Used instead of ImageMagick when it is not installed
+COPY_CONVERT_SCRIPT = (
+    '#!/bin/sh\n# convert <source> -resize <w>x -quality <q> <target>\ncp "$1" "$6"\n'
+)
+
+
+class MeteredRunner:
+    """
+    Wraps a WPCommandRunner (or the fake) and counts the commands it runs
+    by type, with their time and the bytes sent and received.
+    """
+
+    def __init__(self, wp_runner):
+        self.wp_runner = wp_runner
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record(self, command_type, seconds, sent, received):
+        with self.lock:
+            entry = self.commands.setdefault(command_type, {"count": 0, "seconds": 0})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def metered(self, method, command, stdin):
+        start = time.perf_counter()
+        output = ""
+        try:
+            output = method(command, stdin=stdin)
+            return output
+        except UnexpectedExit as e:
+            output = e.result.stdout + e.result.stderr
+            raise
+        finally:
+            self.record(
+                get_command_type(command),
+                time.perf_counter() - start,
+                len(command) + len(stdin or b""),
+                len(output),
+            )
+
+    def run_command(self, command, stdin=None):
+        return self.metered(self.wp_runner.run_command, command, stdin)
+
+    def run_wp_cli(self, command, stdin=None):
+        return self.metered(self.wp_runner.run_wp_cli, command, stdin)
+
+    def run_sql_rows(self, sql):
+        return get_sql_rows(self.run_wp_cli(SQL_COMMAND, stdin=sql.encode("utf-8")))
+
+    def put(self, local_path, remote_path):
+        start = time.perf_counter()
+        self.wp_runner.put(local_path, remote_path)
+        size = 0 if hasattr(local_path, "read") else os.path.getsize(local_path)
+        self.record("put", time.perf_counter() - start, size, 0)
+
+    def stats(self):
+        return self.wp_runner.stats()
+
+    def close(self):
+        self.wp_runner.close()
+
+    def report(self):
+        return {
+            "commands": sum(entry["count"] for entry in self.commands.values()),
+            "commands_by_type": {
+                command_type: {
+                    "count": entry["count"],
+                    "seconds": round(entry["seconds"], 4),
+                }
+                for command_type, entry in sorted(self.commands.items())
+            },
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+        }
+
+
+@contextlib.contextmanager
+def timed(cls, name, samples):
+    """Record the duration of every call of cls.name in samples."""
+    original = getattr(cls, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - start)
+
+    setattr(cls, name, wrapper)
+    try:
+        yield samples
+    finally:
+        setattr(cls, name, original)
+
+
+def summarize(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "total": round(sum(samples), 4),
+        "mean": round(statistics.mean(samples), 6),
+        "p50": round(samples[len(samples) // 2], 6),
+        "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 6),
+        "max": round(samples[-1], 6),
+    }
+
+
+def run_sync(wp_runner, args, verbose=False):
+    """Run one full sync in the current directory and measure it."""
+    metered_runner = MeteredRunner(wp_runner)
+    conversions, json_updates, page_syncs = [], [], []
+    output = sys.stdout if verbose else open(os.devnull, "w")
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(contextlib.redirect_stdout(output))
+        stack.enter_context(timed(WPImageCreator, "optimize_images", conversions))
+        stack.enter_context(timed(JSONUpdator, "apply_updates", json_updates))
+        stack.enter_context(timed(SectorManager, "sync_sector", page_syncs))
+        sector_manager = SectorManager(
+            metered_runner,
+            "redseer-sector-pages.csv",
+            "example.com",
+            jobs=args.jobs,
+        )
+        setup_seconds = time.perf_counter() - start
+        sector_manager.create_sector_pages()
+    wall_seconds = time.perf_counter() - start
+    if not verbose:
+        output.close()
+    result = {
+        "wall_seconds": round(wall_seconds, 4),
+        "setup_seconds": round(setup_seconds, 4),
+        "sync_seconds": round(wall_seconds - setup_seconds, 4),
+        "image_conversion_seconds": round(sum(conversions), 4),
+        "json_update_per_page": summarize(json_updates),
+        "page_sync": summarize(page_syncs),
+    }
+    result.update(metered_runner.report())
+    return result
+
+
+def make_runner(args, experts):
+    if args.backend == "fabric":
+        return WPCommandRunner(
+            args.host, args.user, args.port, wp_path=args.wp_path, pool_size=args.jobs
+        )
+    wp_runner = FakeWPCommandRunner(latency=args.latency)
+    wp_runner.add_sector_templates(make_template(width=args.template_width))
+    for expert in experts:
+        wp_runner.add_user(slugify(expert), expert)
+    return wp_runner
+
+
+def run_scale(pages, args):
+    directory = tempfile.mkdtemp(prefix=f"sector-benchmark-{pages}-")
+    previous_directory = os.getcwd()
+    try:
+        generate_start = time.perf_counter()
+        experts = generate_sector_data(
+            directory, pages, image_size=args.image_size, image_kb=args.image_kb
+        )
+        result = {
+            "pages": pages,
+            "generate_seconds": round(time.perf_counter() - generate_start, 4),
+        }
+        # The scripts read and write relative to the working directory
+        os.chdir(directory)
+        wp_runner = make_runner(args, experts)
+        try:
+            result["cold"] = run_sync(wp_runner, args, args.verbose)
+            if args.warm:
+                # Same site and data again: measures a run with nothing to do
+                result["warm"] = run_sync(wp_runner, args, args.verbose)
+        finally:
+            wp_runner.close()
+        return result
+    finally:
+        os.chdir(previous_directory)
+        if args.keep:
+            print(f"📂 Kept benchmark data in {directory}", file=sys.stderr)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def get_revision():
+    try:
+        return subprocess.run(
+            ["git", "-C", REPO_DIRECTORY, "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the sector page sync.")
+    parser.add_argument(
+        "--pages",
+        default="40,400,4000",
+        help="Comma-separated page counts to run (default: 40,400,4000)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["fake", "fabric"],
+        default="fake",
+        help="fake for the in-memory WordPress, fabric for a real host (default: fake)",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="Seconds per command with the fake backend (default: 0)",
+    )
+    parser.add_argument("--host", default="localhost", help="WordPress host")
+    parser.add_argument("--user", default="ubuntu", help="SSH user")
+    parser.add_argument("--port", type=int, default=22, help="SSH port")
+    parser.add_argument(
+        "--wp-path", default="/home/ubuntu/wordpress", help="WordPress directory"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Pages synced in parallel (default: 1)"
+    )
+    parser.add_argument(
+        "--template-width",
+        type=int,
+        default=3,
+        help="Children per element of the fake templates, sets the page size (default: 3)",
+    )
+    parser.add_argument(
+        "--image-size",
+        default="1920x1080",
+        help="Size of the source images with ImageMagick (default: 1920x1080)",
+    )
+    parser.add_argument(
+        "--image-kb",
+        type=int,
+        default=300,
+        help="Size of the source images without ImageMagick (default: 300)",
+    )
+    parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Run every scale a second time on the same site and data",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated data")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Show the output of the sync"
+    )
+    args = parser.parse_args()
+
+    image_optimizer = "convert"
+    if not shutil.which("convert"):
+        # Time everything else with an optimizer that only copies the file
+        image_optimizer = "copy"
+        args.image_size = None
+        bin_directory = tempfile.mkdtemp(prefix="sector-benchmark-bin-")
+        convert_path = os.path.join(bin_directory, "convert")
+        with open(convert_path, "w") as f:
+            f.write(COPY_CONVERT_SCRIPT)
+        os.chmod(convert_path, 0o755)
+        os.environ["PATH"] = bin_directory + os.pathsep + os.environ["PATH"]
+
+    results = {
+        "revision": get_revision(),
+        "backend": args.backend,
+        "latency": args.latency,
+        "jobs": args.jobs,
+        "image_optimizer": image_optimizer,
+        "scales": [],
+    }
+    for pages in [int(x) for x in args.pages.split(",")]:
+        print(f"⏱️ Benchmarking {pages} pages...", file=sys.stderr)
+        results["scales"].append(run_scale(pages, args))
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,137 @@
+import argparse
+import csv
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from servicescontentcreator import SERVICES  # noqa: E402
+
+# Images every page level reads, see SectorManager.get_image_updates and
+# SectorTabCreator
+IMAGES_BY_LEVEL = {
+    "L1": ["hero.jpg"],
+    "L2": ["hero.jpg", "second-fold-descrition.jpg", "tabimage.jpg"],
+    "L3": ["hero.jpg", "second-fold-descrition.jpg", "tabimage.jpg"],
+}
+TEXT_FILES_BY_LEVEL = {
+    "L1": ["hero-heading.txt", "hero-byline.txt"],
+    "L2": ["tab-description.txt", "hero-heading.txt", "second-fold-description.txt"],
+    "L3": ["tab-description.txt", "hero-heading.txt", "second-fold-description.txt"],
+}
+
+
+def make_source_image(path, image_size, image_kb):
+    """
+    Write one source image: a real JPEG of image_size (WIDTHxHEIGHT) made
+    with ImageMagick, or without an image_size image_kb of random bytes,
+    which is enough for the copy optimizer used when convert is missing.
+    """
+    if image_size:
+        subprocess.run(
+            ["convert", "-size", image_size, "plasma:", "-quality", "95", path],
+            check=True,
+        )
+    else:
+        with open(path, "wb") as f:
+            f.write(os.urandom(image_kb * 1024))
+
+
+def generate_sector_data(
+    directory,
+    pages,
+    subsectors=3,
+    categories=2,
+    experts=20,
+    image_size="1920x1080",
+    image_kb=300,
+    seed=0,
+):
+    """
+    Create redseer-sector-pages.csv with `pages` rows and a matching
+    redseer-sector-data/ tree (text files and images) under directory.
+    Every L1 sector has `subsectors` L2 rows with `categories` L3 rows each.
+    Returns the list of expert names used in the CSV.
+    """
+    rng = random.Random(seed)
+    expert_names = [f"Expert {i}" for i in range(experts)]
+    rows = []
+    sector_number = 0
+    while len(rows) < pages:
+        sector = f"Sector {sector_number}"
+        sector_number += 1
+        rows.append((sector, "L1", "", ""))
+        for s in range(subsectors):
+            subsector = f"{sector} Subsector {s}"
+            rows.append((sector, "L2", subsector, ""))
+            for c in range(categories):
+                rows.append((sector, "L3", subsector, f"{subsector} Category {c}"))
+    rows = rows[:pages]
+
+    os.makedirs(directory, exist_ok=True)
+    data_directory = os.path.join(directory, "redseer-sector-data")
+    # Every image is a copy of one source, generating them is slow
+    source_image = os.path.join(directory, "source-image.jpg")
+    make_source_image(source_image, image_size, image_kb)
+    with open(os.path.join(directory, "redseer-sector-pages.csv"), "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sector", "level", "subsector", "category", "url", "experts"])
+        for sector, level, subsector, category in rows:
+            name = category or subsector or sector
+            slug = name.lower().replace(" ", "-")
+            page_experts = ", ".join(rng.sample(expert_names, rng.randint(0, 3)))
+            writer.writerow(
+                [
+                    sector,
+                    level,
+                    subsector,
+                    category,
+                    f"https://example.com/industries/{slug}",
+                    page_experts,
+                ]
+            )
+            page_directory = os.path.join(
+                data_directory, *[x for x in (sector, subsector, category) if x]
+            )
+            os.makedirs(page_directory, exist_ok=True)
+            for file_name in TEXT_FILES_BY_LEVEL[level]:
+                with open(os.path.join(page_directory, file_name), "w") as text_file:
+                    text_file.write(f"{file_name} of {name}. " * rng.randint(1, 20))
+            for file_name in IMAGES_BY_LEVEL[level]:
+                shutil.copyfile(source_image, os.path.join(page_directory, file_name))
+    for service in SERVICES:
+        service_directory = os.path.join(data_directory, "services", service["name"])
+        os.makedirs(service_directory, exist_ok=True)
+        shutil.copyfile(source_image, os.path.join(service_directory, "image.jpg"))
+    os.remove(source_image)
+    return expert_names
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic sector CSV and data tree."
+    )
+    parser.add_argument("directory", help="Directory to create the data in")
+    parser.add_argument("--pages", type=int, default=40, help="Number of pages")
+    parser.add_argument(
+        "--image-size",
+        default="1920x1080",
+        help="Size of the source images with ImageMagick (default: 1920x1080)",
+    )
+    parser.add_argument(
+        "--image-kb",
+        type=int,
+        default=300,
+        help="Size of the source images without ImageMagick (default: 300)",
+    )
+    args = parser.parse_args()
+    generate_sector_data(
+        args.directory,
+        args.pages,
+        image_size=args.image_size if shutil.which("convert") else None,
+        image_kb=args.image_kb,
+    )
+    print(f"✅ Generated {args.pages} pages in {args.directory}")
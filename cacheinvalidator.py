@@ -0,0 +1,69 @@
+import json
+import threading
+
+# Run with `wp eval-file -`. The post IDs and URLs are filled in as JSON.
+INVALIDATION_SCRIPT = """<?php
+$pages = json_decode(<<<'JSON'
+{pages}
+JSON
+, true);
+$css = class_exists('\\Elementor\\Core\\Files\\CSS\\Post');
+foreach ($pages['post_ids'] as $post_id) {
+    if ($css) {
+        \\Elementor\\Core\\Files\\CSS\\Post::create($post_id)->update();
+    }
+}
+$purge = function_exists('w3tc_flush_url');
+foreach ($pages['urls'] as $url) {
+    if ($purge) {
+        w3tc_flush_url($url);
+    }
+}
+echo 'Regenerated the CSS of ' . ($css ? count($pages['post_ids']) : 0) . ' posts, purged ' . ($purge ? count($pages['urls']) : 0) . " URLs.\\n";
+"""
+
+
+class CacheInvalidator:
+    """
+    Invalidates the caches of the pages a sync wrote, and only those.
+
+    Every page whose _elementor_data is updated is recorded with its URL and
+    the URL of the parent page that lists it in its tabs. invalidate() then
+    regenerates the Elementor CSS of the recorded posts and purges the
+    recorded URLs from the W3 Total Cache page cache, in a single
+    `wp eval-file` call. When no page was written nothing is run, and the
+    rest of the site keeps its caches.
+    """
+
+    def __init__(self, wp_runner):
+        self.wp_runner = wp_runner
+        self.post_ids = set()
+        self.urls = set()
+        self.lock = threading.Lock()
+
+    def record(self, post_id, urls):
+        with self.lock:
+            self.post_ids.add(int(post_id))
+            self.urls.update(urls)
+
+    def invalidate(self):
+        with self.lock:
+            post_ids = sorted(self.post_ids)
+            urls = sorted(self.urls)
+            self.post_ids = set()
+            self.urls = set()
+        if not post_ids:
+            print("⏭️ No pages were written, the caches are left as they are.")
+            return
+        print(
+            f"🧹 Regenerating Elementor CSS of {len(post_ids)} pages and purging "
+            f"{len(urls)} URLs from the page cache..."
+        )
+        # The script goes over stdin, so the lists are not bounded by ARG_MAX
+        script = INVALIDATION_SCRIPT.replace(
+            "{pages}", json.dumps({"post_ids": post_ids, "urls": urls})
+        )
+        output = self.wp_runner.run_wp_cli(
+            "wp eval-file -", stdin=script.encode("utf-8")
+        )
+        print(f"✅ {output.strip()}")
@@ -0,0 +1,105 @@
+import bisect
+import re
+
+try:
+    from text_unidecode import unidecode
+except ImportError:  # Without it, accented names only match exactly
+    unidecode = None
+
+TOKEN = re.compile(r"[^\W_]+")
+
+
+def normalize(text):
+    # Case and spacing do not matter
+    return " ".join(text.casefold().split())
+
+
+def fold(text):
+    # "Zoë Ångström", "zoe-angstrom" and "Zoe  Angstrom" all fold to "zoe angstrom"
+    if unidecode is not None:
+        text = unidecode(text)
+    return " ".join(TOKEN.findall(text.casefold()))
+
+
+class ExpertResolver:
+    """
+    Find the WordPress user of an expert name from the CSV.
+
+    The users are indexed once: by exact login, by exact display name, by
+    the folded form of both (accents, case and punctuation removed, so a
+    login "ajay-karthik" matches "Ajay Karthik") and by their name tokens.
+    A name is looked up in that order, and the first index with a match
+    wins. The token index matches a user when every token of the name is a
+    prefix of one of the user's tokens, e.g. "Ajay K" or "Karthik".
+
+    When an index has several users for a name, the one with the lowest ID
+    is used and the others are reported, so the result does not depend on
+    the order WordPress returned the users in.
+    """
+
+    def __init__(self, users):
+        # user ID -> user, as returned by `wp user list`
+        self.users = {int(user["ID"]): user for user in users}
+        self.by_login = {}
+        self.by_display_name = {}
+        self.by_folded_name = {}
+        # token -> IDs of the users with that token, and all tokens sorted
+        # for the prefix search
+        self.by_token = {}
+        for user_id in sorted(self.users):
+            user = self.users[user_id]
+            login = user.get("user_login") or ""
+            display_name = user.get("display_name") or ""
+            self.by_login.setdefault(normalize(login), []).append(user_id)
+            self.by_display_name.setdefault(normalize(display_name), []).append(user_id)
+            for name in {fold(login), fold(display_name)}:
+                if name:
+                    self.by_folded_name.setdefault(name, []).append(user_id)
+                for token in name.split():
+                    self.by_token.setdefault(token, set()).add(user_id)
+        self.tokens = sorted(self.by_token)
+
+    def find_by_token_prefixes(self, name):
+        user_ids = None
+        for prefix in name.split():
+            matches = set()
+            start = bisect.bisect_left(self.tokens, prefix)
+            for token in self.tokens[start:]:
+                if not token.startswith(prefix):
+                    break
+                matches.update(self.by_token[token])
+            user_ids = matches if user_ids is None else user_ids & matches
+            if not user_ids:
+                return []
+        return sorted(user_ids or [])
+
+    def find(self, expert_name):
+        """All users of the first index that matches, sorted by ID."""
+        folded_name = fold(expert_name)
+        for user_ids in (
+            self.by_login.get(normalize(expert_name)),
+            self.by_display_name.get(normalize(expert_name)),
+            self.by_folded_name.get(folded_name),
+        ):
+            if user_ids:
+                return sorted(set(user_ids))
+        return self.find_by_token_prefixes(folded_name)
+
+    def resolve(self, expert_name):
+        """
+        Get the WordPress user ID for an expert name, or None when no user
+        matches.
+        """
+        user_ids = self.find(expert_name)
+        if not user_ids:
+            return None
+        if len(user_ids) > 1:
+            candidates = ", ".join(
+                f"{user_id} ({self.users[user_id].get('display_name')})"
+                for user_id in user_ids
+            )
+            print(
+                f"⚠️ Expert '{expert_name}' matches {len(user_ids)} users: "
+                f"{candidates}. Using {user_ids[0]}."
+            )
+        return self.users[user_ids[0]]["ID"]
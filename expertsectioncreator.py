@@ -1,13 +1,36 @@
 import json
+import threading
+from expertresolver import ExpertResolver
+
+# Users that can be experts. Subscribers are most of the site's users and
+# never are, so they are not fetched.
+EXCLUDED_EXPERT_ROLES = ["subscriber"]
+USER_FIELDS = "ID,user_login,display_name,user_email"
+
+
+def get_user_list_command(expert_roles=None, fields=USER_FIELDS):
+    # `wp user list` of the users that can be experts
+    if expert_roles:
+        role_filter = f"--role__in={','.join(expert_roles)}"
+    else:
+        role_filter = f"--role__not_in={','.join(EXCLUDED_EXPERT_ROLES)}"
+    return f"wp user list {role_filter} --format=json --fields={fields}"
 
 
 class ExpertSectionCreator:
-    def __init__(self, sector_data, wp_runner):
+    def __init__(self, sector_data, wp_runner, expert_roles=None, lookup_cache=None):
         self.sector_data = sector_data
         self.wp_runner = wp_runner
+        # Roles of the users to look experts up in, all but subscribers if None
+        self.expert_roles = expert_roles
+        self.lookup_cache = lookup_cache
         self.expert_ids = {}
+        self.wp_users = []
+        # The users are loaded on the first expert that is not in the
+        # lookup cache
+        self.expert_resolver = None
+        self.lock = threading.Lock()
         self.load_expert_data_from_csv()
-        self.load_experts_from_wp()
 
     def get_sector_data_directory(self, row):
         # Get the directory path for the sector data based on the level
@@ -20,70 +43,30 @@ class ExpertSectionCreator:
         return None
 
     def load_expert_data_from_csv(self):
-        # Iterate through every sector starting with L3
+        # Refine the experts of every sector with these rules:
         # If an L3 sector has no experts, get them from the parent L2 sector
         # An L2 sector will always have experts
         # An L1 sector may not have experts. Get them as a set of all L2 experts under it
-        unique_experts = set()
-        # CSV data is already loaded into sector_data, so we don't need to read it again
-        # We are only going to refine the data based on the rules above
-        # This may require three passes through the data
-        # First pass: Collect experts for L3 sectors
-        l3_experts = {}
-        l2_sectors = {}
-        l1_sectors = {}
-
+        # CSV data is already loaded into sector_data, so we don't need to read it again.
+        # The parent and children come from the sector tree, and all rules
+        # use the experts as they are in the CSV, so compute them all first.
+        # The experts are kept in CSV order (a dict is an ordered set), so
+        # that every run renders the same expert widget.
+        experts_by_row = []
         for row in self.sector_data:
-            if row.level == "L3":
-                key = (row.sector, row.subsector, row.category)
-                if row.experts:
-                    l3_experts[key] = set(row.experts)
-                else:
-                    l3_experts[key] = set()
-            elif row.level == "L2":
-                key = (row.sector, row.subsector)
-                if row.experts:
-                    l2_sectors[key] = set(row.experts)
-                else:
-                    l2_sectors[key] = set()
+            experts = dict.fromkeys(row.experts)
+            if row.level == "L3" and not experts:
+                parent = self.sector_data.get_parent(row)
+                if parent is not None:
+                    experts = dict.fromkeys(parent.experts)
             elif row.level == "L1":
-                key = row.sector
-                if row.experts:
-                    l1_sectors[key] = set(row.experts)
-                else:
-                    l1_sectors[key] = set()
-
-        # Second pass: Fill in missing L3 experts from parent L2
-        for key in l3_experts:
-            sector, subsector, category = key
-            if not l3_experts[key]:  # If L3 has no experts
-                parent_key = (sector, subsector)
-                if parent_key in l2_sectors:
-                    l3_experts[key] = l2_sectors[parent_key].copy()
-
-        # Third pass: Ensure L1 sectors have all experts from child L2s
-        for key in l1_sectors:
-            sector = key
-            # Find all L2 sectors under this L1
-            for l2_key in l2_sectors:
-                l2_sector, l2_subsector = l2_key
-                if l2_sector == sector:
-                    l1_sectors[sector].update(l2_sectors[l2_key])
+                for child in self.sector_data.get_children(row):
+                    experts.update(dict.fromkeys(child.experts))
+            experts_by_row.append((row, experts))
 
         # Update the original sector_data objects with processed experts
-        for row in self.sector_data:
-            if row.level == "L3":
-                key = (row.sector, row.subsector, row.category)
-                if key in l3_experts:
-                    row.experts = list(l3_experts[key])
-            elif row.level == "L2":
-                key = (row.sector, row.subsector)
-                if key in l2_sectors:
-                    row.experts = list(l2_sectors[key])
-            elif row.level == "L1":
-                key = row.sector
-                if key in l1_sectors:
-                    row.experts = list(l1_sectors[key])
+        for row, experts in experts_by_row:
+            row.experts = list(experts)
 
     def display_expert_data(self):
         # Display the expert data in a structured format
@@ -99,18 +82,18 @@ class ExpertSectionCreator:
             )
 
     def load_experts_from_wp(self):
-        # Get a list of all users from WordPress
-        retval = self.wp_runner.run_wp_cli(
-            "wp user list --format=json --fields=ID,user_login,display_name,user_email"
-        )
+        # Get the users that can be experts from WordPress
+        retval = self.wp_runner.run_wp_cli(get_user_list_command(self.expert_roles))
         if retval:
             self.wp_users = json.loads(retval)
+        self.expert_resolver = ExpertResolver(self.wp_users)
 
     def get_widget_code(self, sector):
         experts = sector.experts
-        for expert in experts:
-            if expert not in self.expert_ids:
-                self.expert_ids[expert] = self.get_expert_id(expert)
+        with self.lock:
+            for expert in experts:
+                if expert not in self.expert_ids:
+                    self.expert_ids[expert] = self.get_expert_id(expert)
         expert_ids = [
             str(self.expert_ids[expert])
             for expert in experts
@@ -123,13 +106,17 @@ class ExpertSectionCreator:
         Get the WordPress user ID for a given expert name.
         If the expert is not found, return None.
         """
-        for user in self.wp_users:
-            expert_name_lower = expert_name.lower()
-            if (
-                expert_name_lower in user["display_name"].lower()
-                or expert_name_lower in user["user_login"].lower()
-            ):
-                return user["ID"]
+        if self.lookup_cache is not None:
+            user_id = self.lookup_cache.get("users", expert_name)
+            if user_id is not None:
+                return user_id
+        if self.expert_resolver is None:
+            self.load_experts_from_wp()
+        user_id = self.expert_resolver.resolve(expert_name)
+        if user_id is not None:
+            if self.lookup_cache is not None:
+                self.lookup_cache.put("users", expert_name, user_id)
+            return user_id
         print(f"❌ Expert '{expert_name}' not found in WordPress users.")
         return None
 
@@ -0,0 +1,496 @@
+import gzip
+import json
+import os
+import re
+import shlex
+import threading
+import time
+from datetime import datetime
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result
+from instrumentation import tracer
+from pagemanifest import payload_md5
+from wpcommandrunner import SQL_COMMAND, get_command_type, get_sql_rows
+
+# The postmeta queries we send through `wp db cli`
+DB_QUERY = re.compile(
+    r"select post_id, (?P<column>meta_value|md5\(meta_value\)) from wppj_postmeta "
+    r"where meta_key='(?P<key>[^']*)' and "
+    r"(?:meta_value like '(?P<pattern>[^']*)'|post_id in \((?P<ids>[\d,\s]*)\))"
+    r"(?: order by meta_id)?;?",
+    re.IGNORECASE,
+)
+# The post_modified query of TemplateCache
+POST_MODIFIED_QUERY = re.compile(
+    r"select ID, post_modified from wppj_posts where ID in \((?P<ids>[\d,\s]*)\);?",
+    re.IGNORECASE,
+)
+# One part of the revalidation query of LookupCache
+LOOKUP_QUERY = re.compile(
+    r"select '(?P<namespace>\w+)', .*? from wppj_(?P<table>posts|postmeta|users) "
+    r"where .*?\b(?:ID|post_id) in \((?P<ids>[\d,\s]*)\).*",
+    re.IGNORECASE,
+)
+
+# Keys under the settings of every element of a generated template, so that
+# any update path of the sector templates finds its field
+TEMPLATE_SETTINGS = {
+    "editor": "",
+    "title": "",
+    "list": [],
+    "shortcode": "",
+    "image": {},
+    "background_image": {},
+}
+
+
+def make_template(sections=7, width=3, depth=2):
+    """
+    Generate Elementor data shaped like the sector templates: `sections`
+    top level sections with `width` child elements nested `depth` levels
+    deep, each with the TEMPLATE_SETTINGS fields.
+    """
+
+    def element(path, level):
+        return {
+            "id": "".join(str(i) for i in path).rjust(7, "0"),
+            "elType": "section" if len(path) == 1 else "widget",
+            "settings": json.loads(json.dumps(TEMPLATE_SETTINGS)),
+            "elements": (
+                [element(path + [i], level - 1) for i in range(width)]
+                if level > 0
+                else []
+            ),
+        }
+
+    return [element([i], depth) for i in range(sections)]
+
+
+def sql_like(pattern):
+    return re.compile(
+        "^" + ".*".join(re.escape(part) for part in pattern.split("%")) + "$"
+    )
+
+
+class FakeWPCommandRunner:
+    """
+    In-memory stand-in for WPCommandRunner and the WordPress it talks to.
+
+    It understands the subset of WP-CLI the sector scripts use (post list and
+    create, post meta get and update, media import, user list, the postmeta
+    and post_modified queries sent to `wp db cli`, the Elementor and W3TC cache flushes and
+    the cache invalidation script run with `wp eval-file -`) plus
+    mktemp, rm and SFTP uploads. Unknown commands fail like a real command
+    would, with UnexpectedExit.
+
+    Every call sleeps for `latency` seconds (a float, or a dict of command
+    type -> seconds with a "default") to stand in for the round trip, and is
+    counted by command type with the bytes sent and received, so a run can
+    be measured without a server.
+    """
+
+    def __init__(self, latency=0.0, wp_path="/home/ubuntu/wordpress"):
+        self.wp_path = wp_path
+        self.latency = latency
+        self.lock = threading.Lock()
+        # post ID -> post fields, as returned by `wp post list`
+        self.posts = {}
+        # post ID -> {meta key: value}
+        self.meta = {}
+        self.users = []
+        # remote path -> bytes, for files uploaded with put()
+        self.files = {}
+        self.next_id = 1
+        self.temp_directories = 0
+        self.counters = {
+            "commands": 0,
+            "uploads": 0,
+            "bytes_sent": 0,
+            "bytes_received": 0,
+        }
+        self.commands_by_type = {}
+        self.flushes = []
+        # {"post_ids", "urls"} of every CacheInvalidator run
+        self.invalidations = []
+
+    # Seeding
+
+    def add_post(
+        self,
+        slug,
+        title="",
+        post_type="page",
+        parent=0,
+        meta=None,
+        post_id=None,
+        modified=None,
+    ):
+        # post_id and modified keep the values of a real site, see SnapshotStore
+        with self.lock:
+            if post_id is None:
+                post_id = self.next_id
+            self.next_id = max(self.next_id, post_id + 1)
+            self.posts[post_id] = {
+                "ID": post_id,
+                "post_name": slug,
+                "post_title": title or slug,
+                "post_parent": int(parent or 0),
+                "post_type": post_type,
+                "post_modified": modified
+                or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self.meta[post_id] = dict(meta or {})
+        return post_id
+
+    def add_user(
+        self,
+        user_login,
+        display_name=None,
+        user_email=None,
+        role="author",
+        user_id=None,
+    ):
+        with self.lock:
+            user = {
+                "ID": user_id if user_id is not None else 1000 + len(self.users),
+                "user_login": user_login,
+                "display_name": display_name or user_login,
+                "user_email": user_email or f"{user_login}@example.com",
+                "roles": role,
+            }
+            self.users.append(user)
+        return user["ID"]
+
+    def add_attachment(self, attached_file, post_id=None):
+        # attached_file is the path under wp-content/uploads, e.g. 2025/06/a.jpg
+        return self.add_post(
+            os.path.splitext(os.path.basename(attached_file))[0],
+            post_type="attachment",
+            meta={"_wp_attached_file": attached_file},
+            post_id=post_id,
+        )
+
+    def add_sector_templates(self, template=None):
+        """
+        Create the pages the sector scripts expect: the sector-level-1 to 3
+        templates, with `template` (or a generated one) as their Elementor
+        data, and the industries parent page.
+        """
+        template = template if template is not None else make_template()
+        for level in range(1, 4):
+            self.add_post(
+                f"sector-level-{level}",
+                f"Sector Level {level}",
+                meta={"_elementor_data": json.dumps(template)},
+            )
+        return self.add_post("industries", "Industries")
+
+    # WPCommandRunner interface
+
+    def run_command(self, command, stdin=None):
+        if isinstance(stdin, str):
+            stdin = stdin.encode("utf-8")
+        command_type = get_command_type(command)
+        with tracer.span("remote", command_type=command_type) as span:
+            stdout = self.run_fake_command(command, command_type, stdin)
+            span["stdout_bytes"] = len(stdout)
+            return stdout
+
+    def run_fake_command(self, command, command_type, stdin):
+        self.wait(command_type)
+        with self.lock:
+            self.counters["commands"] += 1
+            self.counters["bytes_sent"] += len(command) + len(stdin or b"")
+            self.commands_by_type[command_type] = (
+                self.commands_by_type.get(command_type, 0) + 1
+            )
+            try:
+                exited, stdout, stderr = self.execute(command, stdin)
+            except (ValueError, KeyError, IndexError) as e:
+                exited, stdout, stderr = 1, "", f"Error: {e}"
+            self.counters["bytes_received"] += len(stdout) + len(stderr)
+        if exited != 0:
+            raise UnexpectedExit(
+                Result(
+                    stdout=stdout,
+                    stderr=stderr,
+                    command=command,
+                    exited=exited,
+                    hide=("stdout", "stderr"),
+                )
+            )
+        return stdout.strip()
+
+    def run_wp_cli(self, command, stdin=None):
+        return self.run_command(f"cd {self.wp_path} && {command}", stdin)
+
+    def run_sql_rows(self, sql):
+        return get_sql_rows(self.run_wp_cli(SQL_COMMAND, stdin=sql.encode("utf-8")))
+
+    def put(self, local_path, remote_path):
+        if hasattr(local_path, "read"):
+            data = local_path.read()
+        else:
+            with open(local_path, "rb") as f:
+                data = f.read()
+        with tracer.span("remote", command_type="put"):
+            self.wait("put")
+            with self.lock:
+                self.files[remote_path] = data
+                self.counters["uploads"] += 1
+                self.counters["bytes_sent"] += len(data)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["commands_by_type"] = dict(self.commands_by_type)
+        return stats
+
+    def close(self):
+        pass
+
+    def wait(self, command_type):
+        latency = self.latency
+        if isinstance(latency, dict):
+            latency = latency.get(command_type, latency.get("default", 0.0))
+        if latency:
+            time.sleep(latency)
+
+    # Command emulation, called with the lock held
+
+    def execute(self, command, stdin):
+        """Run a command against the in-memory site. Returns (exit code, stdout, stderr)."""
+        if command.startswith("cd ") and " && " in command:
+            command = command.split(" && ", 1)[1]
+        if command == SQL_COMMAND:
+            return self.db_query((stdin or b"").decode("utf-8"))
+        pipefail = command.startswith("set -o pipefail; ")
+        if pipefail:
+            command = command[len("set -o pipefail; ") :]
+        if command.startswith("gzip -dc | "):
+            command = command[len("gzip -dc | ") :]
+            try:
+                stdin = gzip.decompress(stdin)
+            except (OSError, EOFError) as e:
+                if pipefail:
+                    return 1, "", f"gzip: stdin: {e}"
+                # As in a shell, wp gets what gzip wrote and succeeds
+                stdin = b""
+        words = shlex.split(command)
+        if words[0] == "mktemp":
+            self.temp_directories += 1
+            return 0, f"/tmp/wp-media-import-{self.temp_directories:06d}\n", ""
+        if words[0] == "rm":
+            for path in words[1:]:
+                if not path.startswith("-"):
+                    for remote_path in [
+                        p for p in self.files if p == path or p.startswith(f"{path}/")
+                    ]:
+                        del self.files[remote_path]
+            return 0, "", ""
+        if words[0] != "wp":
+            return 127, "", f"{words[0]}: command not found"
+        args = [word for word in words[1:] if not word.startswith("--")]
+        options = dict(
+            (word[2:].split("=", 1) + [True])[:2]
+            for word in words[1:]
+            if word.startswith("--")
+        )
+        subcommand = " ".join(args[:3])
+        if subcommand.startswith("post list"):
+            return self.post_list(options)
+        if subcommand.startswith("post create"):
+            return self.post_create(options)
+        if subcommand.startswith("post meta get"):
+            return self.post_meta_get(args[3], args[4])
+        if subcommand.startswith("post meta update"):
+            value = args[5] if len(args) > 5 else (stdin or b"").decode("utf-8")
+            return self.post_meta_update(args[3], args[4], value)
+        if subcommand.startswith("media import"):
+            return self.media_import(args[2:])
+        if subcommand.startswith("user list"):
+            return self.user_list(options)
+        if subcommand == "eval-file -":
+            return self.invalidate_caches((stdin or b"").decode("utf-8"))
+        if subcommand.startswith("elementor flush_css") or subcommand.startswith(
+            "w3-total-cache flush"
+        ):
+            self.flushes.append(subcommand)
+            return 0, "Success: Flushed.\n", ""
+        return 1, "", f"Error: '{' '.join(args[:2])}' is not a registered wp command."
+
+    def post_list(self, options):
+        post_type = options.get("post_type", "post")
+        fields = options.get("fields", "ID,post_title,post_name").split(",")
+        posts = [
+            {field: post.get(field, "") for field in fields}
+            for post in self.posts.values()
+            if post["post_type"] == post_type
+        ]
+        return 0, json.dumps(posts), ""
+
+    def post_create(self, options):
+        template_id = int(options.get("from-post", 0))
+        if template_id and template_id not in self.posts:
+            return 1, "", f"Error: Could not find the post with ID {template_id}."
+        post_id = self.next_id
+        self.next_id += 1
+        self.posts[post_id] = {
+            "ID": post_id,
+            "post_name": options.get("post_name", ""),
+            "post_title": options.get("post_title", ""),
+            "post_parent": int(options.get("post_parent", 0) or 0),
+            "post_type": options.get("post_type", "post"),
+            "post_modified": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        # --from-post copies the meta of the template too
+        self.meta[post_id] = dict(self.meta.get(template_id, {}))
+        return 0, f"{post_id}\n", ""
+
+    def post_meta_get(self, post_id, key):
+        value = self.meta.get(int(post_id), {}).get(key)
+        if value is None:
+            return 1, "", ""
+        return 0, f"{value}\n", ""
+
+    def post_meta_update(self, post_id, key, value):
+        post_id = int(post_id)
+        if post_id not in self.posts:
+            return 1, "", f"Error: Could not find the post with ID {post_id}."
+        self.meta[post_id][key] = value
+        return 0, f"Success: Updated custom field '{key}'.\n", ""
+
+    def media_import(self, paths):
+        ids = []
+        errors = []
+        month = datetime.now().strftime("%Y/%m")
+        attached = {
+            meta.get("_wp_attached_file") for meta in self.meta.values() if meta
+        }
+        for path in paths:
+            if path not in self.files:
+                errors.append(f"Warning: Unable to import file '{path}'.")
+                continue
+            # WordPress adds a suffix when the file name is taken
+            stem, extension = os.path.splitext(os.path.basename(path))
+            file_name, suffix = f"{stem}{extension}", 0
+            while f"{month}/{file_name}" in attached:
+                suffix += 1
+                file_name = f"{stem}-{suffix}{extension}"
+            attached.add(f"{month}/{file_name}")
+            post_id = self.next_id
+            self.next_id += 1
+            self.posts[post_id] = {
+                "ID": post_id,
+                "post_name": os.path.splitext(file_name)[0],
+                "post_title": stem,
+                "post_parent": 0,
+                "post_type": "attachment",
+                "post_modified": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self.meta[post_id] = {"_wp_attached_file": f"{month}/{file_name}"}
+            ids.append(str(post_id))
+        stdout = "".join(f"{post_id}\n" for post_id in ids)
+        if errors:
+            errors.append(f"Error: Only imported {len(ids)} of {len(paths)} items.")
+            return 1, stdout, "\n".join(errors)
+        return 0, stdout, ""
+
+    def user_list(self, options):
+        fields = options.get("fields", "ID,user_login,display_name,user_email")
+        roles_in = options.get("role__in") or options.get("role")
+        roles_not_in = options.get("role__not_in")
+        users = [
+            {field: user.get(field, "") for field in fields.split(",")}
+            for user in self.users
+            # roles is comma separated, as WP-CLI prints it
+            if (
+                not roles_in or set(user["roles"].split(",")) & set(roles_in.split(","))
+            )
+            and not (
+                roles_not_in
+                and set(user["roles"].split(",")) & set(roles_not_in.split(","))
+            )
+        ]
+        return 0, json.dumps(users), ""
+
+    def invalidate_caches(self, script):
+        # Only the script of CacheInvalidator is understood
+        match = re.search(r"<<<'JSON'\n(.*)\nJSON\n", script, re.DOTALL)
+        if not match:
+            return 255, "", "PHP Parse error: unsupported script"
+        pages = json.loads(match.group(1))
+        self.invalidations.append(pages)
+        return (
+            0,
+            f"Regenerated the CSS of {len(pages['post_ids'])} posts, "
+            f"purged {len(pages['urls'])} URLs.\n",
+            "",
+        )
+
+    def db_query(self, sql):
+        if LOOKUP_QUERY.match(sql.strip()):
+            return self.lookup_query(sql)
+        match = POST_MODIFIED_QUERY.fullmatch(sql.strip())
+        if match:
+            lines = ["ID\tpost_modified"]
+            for post_id in sorted(
+                {int(i) for i in match.group("ids").split(",") if i.strip()}
+            ):
+                if post_id in self.posts:
+                    lines.append(f"{post_id}\t{self.posts[post_id]['post_modified']}")
+            return 0, "\n".join(lines) + "\n", ""
+        match = DB_QUERY.fullmatch(sql.strip())
+        if not match:
+            return 1, "", f"ERROR 1064 (42000): Unsupported query: {sql}"
+        key = match.group("key")
+        post_ids, pattern = None, None
+        if match.group("ids") is not None:
+            post_ids = {int(i) for i in match.group("ids").split(",") if i.strip()}
+        else:
+            pattern = sql_like(match.group("pattern"))
+        column = match.group("column")
+        lines = [f"post_id\t{column}"]
+        for post_id in sorted(self.meta):
+            value = self.meta[post_id].get(key)
+            if value is None:
+                continue
+            if post_ids is not None and post_id not in post_ids:
+                continue
+            if pattern is not None and not pattern.match(value):
+                continue
+            if column != "meta_value":
+                value = payload_md5(value)
+            lines.append(f"{post_id}\t{value}")
+        return 0, "\n".join(lines) + "\n", ""
+
+    def lookup_query(self, sql):
+        lines = ["pages\tID\tpost_name\tpost_parent\tpost_modified"]
+        for part in sql.strip().rstrip(";").split(" union all "):
+            match = LOOKUP_QUERY.fullmatch(part.strip())
+            if not match:
+                return 1, "", f"ERROR 1064 (42000): Unsupported query: {part}"
+            namespace = match.group("namespace")
+            ids = {int(i) for i in match.group("ids").split(",") if i.strip()}
+            table = match.group("table")
+            for row_id in sorted(ids):
+                if table == "posts" and row_id in self.posts:
+                    post = self.posts[row_id]
+                    row = [
+                        post["post_name"],
+                        post["post_parent"],
+                        post["post_modified"],
+                    ]
+                elif table == "postmeta" and "_wp_attached_file" in self.meta.get(
+                    row_id, {}
+                ):
+                    row = [self.meta[row_id]["_wp_attached_file"], 0, 0]
+                elif table == "users" and any(
+                    user["ID"] == row_id for user in self.users
+                ):
+                    user = next(user for user in self.users if user["ID"] == row_id)
+                    row = [user["user_login"], 0, 0]
+                else:
+                    continue
+                lines.append("\t".join(str(x) for x in [namespace, row_id] + row))
+        return 0, "\n".join(lines) + "\n", ""
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+
+IMAGE_CACHE_FILE = "redseer-sector-data/image-cache.json"
+
+
+class ImageCache:
+    """
+    Content addressed cache of optimized images.
+
+    Entries are keyed by the sha256 of the source image plus the width and
+    quality it was optimized with and the optimized image name (the same
+    placeholder image is often used for many pages), and map to the
+    optimized file. An image whose source has not changed is not optimized
+    again. A changed source has a new key, so it is optimized again and its
+    entry is marked as replaced.
+
+    Only what happened on this machine is kept here. Which attachment an
+    image was uploaded as, and from which source, depends on the host and is
+    kept by MediaIndex in the host's LookupCache.
+
+    Source hashes are remembered with the file's size and mtime, so unchanged
+    sources are not read again on every run.
+
+    Entries are written to disk by save(), not on every put().
+    """
+
+    def __init__(self, path=IMAGE_CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.entries = {}
+        # optimized path -> key of its entry
+        self.keys_by_path = {}
+        # source path -> {"size", "mtime", "sha256"}
+        self.sources = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                # Attachment IDs used to be kept in the entries as well, for
+                # whichever host was synced last. They are dropped.
+                self.entries = {
+                    key: {
+                        "optimized_path": entry["optimized_path"],
+                        "image_name": entry["image_name"],
+                        "replaced": entry.get("replaced", False),
+                    }
+                    for key, entry in data.get("entries", {}).items()
+                }
+                self.sources = data.get("sources", {})
+            except ValueError:
+                print(f"❌ Invalid image cache {path}, starting with an empty one.")
+        for key, entry in self.entries.items():
+            self.keys_by_path[entry["optimized_path"]] = key
+
+    def get_source_hash(self, source_path):
+        stat = os.stat(source_path)
+        with self.lock:
+            known = self.sources.get(source_path)
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return known["sha256"]
+        digest = hashlib.sha256()
+        with open(source_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        with self.lock:
+            self.sources[source_path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha256": digest.hexdigest(),
+            }
+            self.dirty = True
+        return digest.hexdigest()
+
+    def get_key(self, source_path, width, quality, image_name):
+        return f"{self.get_source_hash(source_path)}:{width}:{quality}:{image_name}"
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def find_by_optimized_path(self, optimized_path):
+        with self.lock:
+            key = self.keys_by_path.get(optimized_path)
+            if key is None:
+                return None, None
+            return key, self.entries[key]
+
+    def put(self, key, optimized_path, image_name, replaced=False):
+        """
+        Record an optimized image. replaced marks a file that was made from a
+        new version of its source, so an attachment with the same name in a
+        media library may be out of date, see WPImageCreator.get_cache_state.
+        """
+        with self.lock:
+            # An optimized file belongs to one source version only
+            previous_key = self.keys_by_path.get(optimized_path)
+            if previous_key is not None and previous_key != key:
+                del self.entries[previous_key]
+            previous_entry = self.entries.get(key)
+            if previous_entry is not None:
+                self.keys_by_path.pop(previous_entry["optimized_path"], None)
+            self.keys_by_path[optimized_path] = key
+            self.entries[key] = {
+                "optimized_path": optimized_path,
+                "image_name": image_name,
+                "replaced": replaced,
+            }
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(
+                    {"entries": self.entries, "sources": self.sources},
+                    f,
+                    indent=4,
+                    sort_keys=True,
+                )
+            os.replace(temp_path, self.path)
+            self.dirty = False
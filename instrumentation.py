@@ -0,0 +1,157 @@
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer:
+    """
+    Timing spans for a sync run.
+
+    Code wraps its phases in `with tracer.span(name, **attributes)`. Each
+    span is timed, gets the sector slug of the span it is nested in (spans
+    are tracked per thread, so parallel page workers do not mix), and is
+    added to running totals that the end-of-run summary is built from.
+    When a trace file is open, every finished span is also written to it as
+    one JSON line. Caches report lookups with tracer.cache(name, hit).
+
+    Finishing a span is a dict update under a lock and, with a trace file,
+    one buffered write, so the tracer is left on for every run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.ids = itertools.count(1)
+        self.trace_file = None
+        # span name -> {"count", "seconds"}
+        self.spans = {}
+        # command type -> {"count", "seconds", "stdout_bytes"}
+        self.commands = {}
+        # (seconds, sector slug) of every page
+        self.pages = []
+        # cache name -> {"hits", "misses"}
+        self.caches = {}
+
+    def open(self, path):
+        """Write every span to path as JSON lines from now on."""
+        with self.lock:
+            self.trace_file = open(path, "a", buffering=1024 * 1024)
+
+    def close(self):
+        with self.lock:
+            if self.trace_file is not None:
+                self.trace_file.close()
+                self.trace_file = None
+
+    def stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Time the block. Yields the span record, so the block can add
+        attributes to it, e.g. span["stdout_bytes"] = len(stdout).
+        """
+        stack = self.stack()
+        record = {"name": name, "id": next(self.ids)}
+        if stack:
+            record["parent"] = stack[-1]["id"]
+            if "sector" in stack[-1]:
+                record["sector"] = stack[-1]["sector"]
+        record.update(attributes)
+        stack.append(record)
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["duration"] = round(time.perf_counter() - start, 6)
+            record["start"] = round(started, 6)
+            stack.pop()
+            self.finish(record)
+
+    def finish(self, record):
+        with self.lock:
+            totals = self.spans.setdefault(record["name"], {"count": 0, "seconds": 0})
+            totals["count"] += 1
+            totals["seconds"] += record["duration"]
+            if "command_type" in record:
+                totals = self.commands.setdefault(
+                    record["command_type"],
+                    {"count": 0, "seconds": 0, "stdout_bytes": 0},
+                )
+                totals["count"] += 1
+                totals["seconds"] += record["duration"]
+                totals["stdout_bytes"] += record.get("stdout_bytes", 0)
+            if record["name"] == "page":
+                self.pages.append((record["duration"], record.get("sector")))
+            if self.trace_file is not None:
+                self.trace_file.write(json.dumps(record, default=str) + "\n")
+
+    def cache(self, name, hit):
+        """Count a cache lookup."""
+        with self.lock:
+            totals = self.caches.setdefault(name, {"hits": 0, "misses": 0})
+            totals["hits" if hit else "misses"] += 1
+
+    def summary(self, top=10):
+        with self.lock:
+            return {
+                "slowest_pages": [
+                    {"sector": sector, "seconds": round(seconds, 3)}
+                    for seconds, sector in sorted(self.pages, reverse=True)[:top]
+                ],
+                "commands": {
+                    command_type: dict(totals, seconds=round(totals["seconds"], 3))
+                    for command_type, totals in sorted(
+                        self.commands.items(), key=lambda item: -item[1]["seconds"]
+                    )
+                },
+                "spans": {
+                    name: dict(totals, seconds=round(totals["seconds"], 3))
+                    for name, totals in sorted(self.spans.items())
+                },
+                "caches": {
+                    name: dict(
+                        totals,
+                        hit_rate=round(
+                            totals["hits"] / max(1, totals["hits"] + totals["misses"]),
+                            3,
+                        ),
+                    )
+                    for name, totals in sorted(self.caches.items())
+                },
+            }
+
+    def print_summary(self, top=10):
+        summary = self.summary(top)
+        print("📊 Run summary")
+        if summary["slowest_pages"]:
+            print(f"🐢 Slowest {len(summary['slowest_pages'])} pages:")
+            for page in summary["slowest_pages"]:
+                print(f"   {page['seconds']:8.3f}s  {page['sector']}")
+        if summary["commands"]:
+            print("📡 Time per remote command type:")
+            for command_type, totals in summary["commands"].items():
+                print(
+                    f"   {totals['seconds']:8.3f}s  {totals['count']:5d} x {command_type}"
+                    f" ({totals['stdout_bytes']} bytes out)"
+                )
+        if summary["caches"]:
+            print("🎯 Cache hit rates:")
+            for name, totals in summary["caches"].items():
+                print(
+                    f"   {totals['hit_rate']:6.1%}  {name}"
+                    f" ({totals['hits']} hits, {totals['misses']} misses)"
+                )
+
+
+# The tracer of this process, shared by all modules
+tracer = Tracer()
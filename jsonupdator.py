@@ -1,5 +1,41 @@
 import json
+import re
+from functools import lru_cache
 from jsonpath_ng.ext import parse
+from instrumentation import tracer
+
+# One step of a simple selector: [0], .[0], elements or .elements
+SIMPLE_SELECTOR_STEP = re.compile(r"\.?\[(\d+)\]|\.?([A-Za-z_][A-Za-z0-9_-]*)")
+
+
+@lru_cache(maxsize=256)
+def compile_selector(selector):
+    """Parse a JSONPath selector once per process. The ply parser is slow."""
+    return parse(selector)
+
+
+@lru_cache(maxsize=256)
+def parse_simple_selector(selector):
+    """
+    Split selectors made of only list indexes and field names, like
+    "$[0].elements[0].settings.editor", into a tuple of steps such as
+    (0, "elements", 0, "settings", "editor"). These can be resolved by walking
+    the JSON directly. Returns None for anything else (filters, wildcards...).
+    """
+    position = 1 if selector.startswith("$") else 0
+    steps = []
+    while position < len(selector):
+        match = SIMPLE_SELECTOR_STEP.match(selector, position)
+        if not match:
+            return None
+        index, field = match.groups()
+        steps.append(int(index) if index is not None else field)
+        position = match.end()
+    return tuple(steps) if steps else None
+
+
+def format_steps(steps):
+    return ".".join(f"[{step}]" if isinstance(step, int) else step for step in steps)
 
 
 class JSONUpdator:
@@ -11,7 +47,64 @@ class JSONUpdator:
         The selector is a JSONPath string that specifies the path to the value to be updated.
         The new_value is the value to set at that path.
         """
-        jsonpath_expr = parse(selector)
+        return self.apply_updates([(selector, new_value)], allow_multiple_matches)
+
+    def apply_updates(self, updates, allow_multiple_matches=False):
+        """
+        Apply a list of (selector, new_value) updates in one pass.
+        Simple selectors are resolved by walking the JSON, and the containers
+        found on the way are reused by later selectors that share a prefix,
+        so the tree is not walked from the root for every update. Other
+        selectors go through jsonpath.
+        """
+        with tracer.span("json.update", updates=len(updates)):
+            return self.apply_updates_traced(updates, allow_multiple_matches)
+
+    def apply_updates_traced(self, updates, allow_multiple_matches):
+        # Steps of a path prefix -> the container found at that prefix
+        containers = {(): self.json_data}
+        for selector, new_value in updates:
+            steps = parse_simple_selector(selector)
+            if steps is None:
+                self.update_jsonpath(selector, new_value, allow_multiple_matches)
+                # The update may have replaced any container we found so far
+                containers = {(): self.json_data}
+                continue
+            parent = self.resolve(steps[:-1], containers)
+            key = steps[-1]
+            if not self.has_key(parent, key):
+                raise ValueError(f"No matches found for selector: {selector}")
+            print(f"Updating match: {format_steps(steps)}")
+            parent[key] = new_value
+            # Forget containers under the updated path, they were replaced
+            for prefix in [p for p in containers if p[: len(steps)] == steps]:
+                del containers[prefix]
+        return self.json_data
+
+    def resolve(self, steps, containers):
+        # Start from the longest prefix of steps that was resolved before
+        length = len(steps)
+        while steps[:length] not in containers:
+            length -= 1
+        node = containers[steps[:length]]
+        for position in range(length, len(steps)):
+            step = steps[position]
+            if not self.has_key(node, step):
+                raise ValueError(
+                    f"No matches found for selector: {format_steps(steps)}"
+                )
+            node = node[step]
+            containers[steps[: position + 1]] = node
+        return node
+
+    @staticmethod
+    def has_key(node, step):
+        if isinstance(step, int):
+            return isinstance(node, list) and 0 <= step < len(node)
+        return isinstance(node, dict) and step in node
+
+    def update_jsonpath(self, selector, new_value, allow_multiple_matches=False):
+        jsonpath_expr = compile_selector(selector)
         matches = jsonpath_expr.find(self.json_data)
 
         if not matches:
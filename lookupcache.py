@@ -0,0 +1,211 @@
+import json
+import os
+import threading
+import time
+from instrumentation import tracer
+from mediaindex import get_upload_name
+
+LOOKUP_CACHE_FILE = "redseer-sector-data/lookup-cache.json"
+LOOKUP_CACHE_VERSION = 1
+# Seconds an entry is trusted without asking the server again. Pages are
+# the most likely to be renamed, moved or deleted, so they expire soonest.
+# Nothing reads the post_modified of a cached page, TemplateCache asks the
+# server for the post_modified of the templates.
+# The sources of our uploads do not change, their attachments are "media".
+DEFAULT_TTLS = {
+    "pages": 3600,
+    "media": 7 * 24 * 3600,
+    "users": 24 * 3600,
+    "sources": float("inf"),
+}
+
+# One part of the revalidation query per namespace. Every part returns
+# (namespace, ID, name, parent, modified), so they can be joined with union.
+REVALIDATION_QUERIES = {
+    "pages": "select 'pages', ID, post_name, post_parent, post_modified from wppj_posts where ID in ({ids}) and post_status not in ('trash','auto-draft')",
+    "media": "select 'media', post_id, meta_value, 0, 0 from wppj_postmeta where meta_key='_wp_attached_file' and post_id in ({ids})",
+    "users": "select 'users', ID, user_login, 0, 0 from wppj_users where ID in ({ids})",
+}
+
+
+def get_entry_id(namespace, value):
+    # The WordPress ID an entry of a namespace stands for
+    if namespace == "pages":
+        return value["ID"]
+    if namespace == "media":
+        return value[0]
+    return value
+
+
+class LookupCache:
+    """
+    Facts looked up on a WordPress host, kept across runs.
+
+    Entries are stored per host and namespace: "pages" maps a slug to its
+    page record (ID, post_name, post_parent, post_modified), "media" maps an
+    optimized image name to (attachment ID, URL path), "sources" maps it to
+    the image cache key of the source it was uploaded from and "users" maps
+    an expert name to a user ID. An entry is trusted for the TTL of its
+    namespace. Expired entries are checked with revalidate(), which asks the
+    server about all of them in one query and drops the ones that are gone
+    or changed. With refresh the host's entries are discarded, so
+    everything is looked up again.
+
+    Entries are written to disk by save(), not on every put().
+    """
+
+    def __init__(self, host, path=LOOKUP_CACHE_FILE, ttls=None, refresh=False):
+        self.host = host
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.lock = threading.Lock()
+        self.dirty = False
+        # host -> namespace -> key -> {"value", "checked"}
+        self.hosts = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == LOOKUP_CACHE_VERSION:
+                    self.hosts = data.get("hosts", {})
+            except ValueError:
+                print(f"❌ Invalid lookup cache {path}, starting with an empty one.")
+        if refresh and self.hosts.pop(host, None) is not None:
+            print(f"🧹 Discarded the cached lookups of {host}.")
+            self.dirty = True
+        self.entries = self.hosts.setdefault(host, {})
+
+    def is_fresh(self, namespace, entry, now=None):
+        now = now if now is not None else time.time()
+        return now - entry["checked"] < self.ttls.get(namespace, 0)
+
+    def get(self, namespace, key):
+        """The value of a fresh entry, or None."""
+        with self.lock:
+            entry = self.entries.get(namespace, {}).get(key)
+            hit = entry is not None and self.is_fresh(namespace, entry)
+        tracer.cache(f"lookup_{namespace}", hit)
+        return entry["value"] if hit else None
+
+    def get_all(self, namespace):
+        """key -> value of every fresh entry of a namespace."""
+        now = time.time()
+        with self.lock:
+            return {
+                key: entry["value"]
+                for key, entry in self.entries.get(namespace, {}).items()
+                if self.is_fresh(namespace, entry, now)
+            }
+
+    def put(self, namespace, key, value):
+        with self.lock:
+            self.entries.setdefault(namespace, {})[key] = {
+                "value": value,
+                "checked": time.time(),
+            }
+            self.dirty = True
+
+    def replace(self, namespace, values):
+        """Replace a namespace with values that were all just looked up."""
+        now = time.time()
+        with self.lock:
+            self.entries[namespace] = {
+                key: {"value": value, "checked": now} for key, value in values.items()
+            }
+            self.dirty = True
+
+    def remove(self, namespace, key):
+        with self.lock:
+            if self.entries.get(namespace, {}).pop(key, None) is not None:
+                self.dirty = True
+
+    def revalidate(self, wp_runner, force=None):
+        """
+        Check every expired entry, and the keys of force (namespace -> keys)
+        even if they are fresh, against the server in one `wp db cli` call.
+        Entries the server confirms are updated and trusted again for their
+        TTL, the others are dropped.
+        """
+        force = force or {}
+        now = time.time()
+        with self.lock:
+            pending = {
+                namespace: {
+                    key: entry["value"]
+                    for key, entry in entries.items()
+                    if key in force.get(namespace, ())
+                    or not self.is_fresh(namespace, entry, now)
+                }
+                for namespace, entries in self.entries.items()
+                if namespace in REVALIDATION_QUERIES
+            }
+        pending = {namespace: keys for namespace, keys in pending.items() if keys}
+        if not pending:
+            return
+        count = sum(len(keys) for keys in pending.values())
+        print(f"📀 Revalidating {count} cached lookups...")
+        queries = [
+            REVALIDATION_QUERIES[namespace].format(
+                ids=",".join(
+                    sorted(
+                        {str(int(get_entry_id(namespace, v))) for v in keys.values()}
+                    )
+                )
+            )
+            for namespace, keys in sorted(pending.items())
+        ]
+        # (namespace, ID) -> (name, parent, modified)
+        rows = {}
+        for row in wp_runner.run_sql_rows(f"{' union all '.join(queries)};"):
+            if len(row) == 5:
+                rows[(row[0], row[1])] = row[2:]
+        confirmed = {}
+        for namespace, keys in pending.items():
+            for key, value in keys.items():
+                entry_id = str(get_entry_id(namespace, value))
+                row = rows.get((namespace, entry_id))
+                if row is None:
+                    continue
+                name, parent, modified = row
+                if namespace == "pages" and name == key:
+                    confirmed[(namespace, key)] = dict(
+                        value, post_parent=int(parent), post_modified=modified
+                    )
+                elif (
+                    namespace == "media"
+                    and get_upload_name(os.path.basename(name)) == key
+                ):
+                    confirmed[(namespace, key)] = [entry_id, name]
+                elif namespace == "users":
+                    confirmed[(namespace, key)] = value
+        with self.lock:
+            for namespace, keys in pending.items():
+                entries = self.entries.get(namespace, {})
+                for key in keys:
+                    if (namespace, key) in confirmed:
+                        entries[key] = {
+                            "value": confirmed[(namespace, key)],
+                            "checked": now,
+                        }
+                    else:
+                        entries.pop(key, None)
+            self.dirty = True
+        print(f"✅ {len(confirmed)} of {count} cached lookups are still valid.")
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump(
+                    {"version": LOOKUP_CACHE_VERSION, "hosts": self.hosts},
+                    f,
+                    indent=4,
+                    sort_keys=True,
+                )
+            os.replace(temp_path, self.path)
+            self.dirty = False
@@ -0,0 +1,114 @@
+import os
+import re
+import threading
+from instrumentation import tracer
+
+# WordPress adds a -<n> suffix to a file name that is taken, so a new
+# version of x-optimized.jpg is attached as x-optimized-1.jpg
+RENAMED_FILE = re.compile(r"(?P<stem>.+-optimized)-\d+(?P<extension>\.jpg)")
+
+
+def get_upload_name(file_name):
+    """The name an attached file was uploaded with."""
+    match = RENAMED_FILE.fullmatch(file_name)
+    if match:
+        return f"{match['stem']}{match['extension']}"
+    return file_name
+
+
+class MediaIndex:
+    """
+    In-memory index of media library attachments by file name.
+
+    The _wp_attached_file rows are loaded once with a single query, limited to
+    our optimized image naming scheme, instead of a LIKE scan of the postmeta
+    table for every image. Uploads made during the run are added with add().
+    A file uploaded again is attached under a new name, and the newest
+    attachment of a name wins.
+    With a LookupCache, the attachments cached by earlier runs answer
+    lookups, and the index is only loaded for a file name that is not cached.
+
+    The index also remembers the image cache key of the source every
+    attachment was made from (see set_source), so an image whose source
+    changed is uploaded again on every host.
+    """
+
+    def __init__(self, wp_runner, file_pattern="%-optimized%.jpg", lookup_cache=None):
+        self.wp_runner = wp_runner
+        self.file_pattern = file_pattern
+        self.lookup_cache = lookup_cache
+        # file name -> (attachment ID, path relative to wp-content/uploads)
+        self.attachments = {}
+        # file name -> image cache key of the source of its attachment
+        self.sources = {}
+        if lookup_cache is not None:
+            self.attachments = {
+                name: tuple(attachment)
+                for name, attachment in lookup_cache.get_all("media").items()
+            }
+            self.sources = lookup_cache.get_all("sources")
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+
+    def load(self):
+        print("📀 Loading media index from WordPress...")
+        rows = self.wp_runner.run_sql_rows(
+            f"select post_id, meta_value from wppj_postmeta where meta_key='_wp_attached_file' and meta_value like '{self.file_pattern}' order by meta_id;"
+        )
+        attachments = {}
+        for row in rows:
+            if len(row) == 2:
+                image_id, image_url = row
+                # Later uploads of the same file name win, as before
+                attachments[get_upload_name(os.path.basename(image_url))] = (
+                    image_id,
+                    image_url,
+                )
+        with self.lock:
+            self.attachments = attachments
+            self.loaded = True
+        if self.lookup_cache is not None:
+            self.lookup_cache.replace("media", attachments)
+        print(f"✅ Media index loaded with {len(attachments)} images.")
+
+    def get(self, image_file_name):
+        """Get (attachment ID, URL path) for a file name, or (None, None)."""
+        with self.lock:
+            cached = image_file_name in self.attachments
+        if not cached and not self.loaded:
+            with self.load_lock:
+                if not self.loaded:
+                    self.load()
+        with self.lock:
+            attachment = self.attachments.get(image_file_name, (None, None))
+        tracer.cache("media_index", attachment[0] is not None)
+        return attachment
+
+    def get_cached(self, image_file_name):
+        """(attachment ID, URL path) if the file is known, without loading."""
+        with self.lock:
+            return self.attachments.get(image_file_name)
+
+    def add(self, image_id, image_url, image_file_name=None):
+        # The file name is the one of the URL, unless WordPress renamed the file
+        image_file_name = image_file_name or get_upload_name(
+            os.path.basename(image_url)
+        )
+        with self.lock:
+            self.attachments[image_file_name] = (str(image_id), image_url)
+        if self.lookup_cache is not None:
+            self.lookup_cache.put("media", image_file_name, (str(image_id), image_url))
+
+    def get_source(self, image_file_name):
+        """The key of the source the attachment of a file was made from, or None."""
+        with self.lock:
+            return self.sources.get(image_file_name)
+
+    def set_source(self, image_file_name, key):
+        with self.lock:
+            if self.sources.get(image_file_name) == key:
+                return
+            self.sources[image_file_name] = key
+        if self.lookup_cache is not None:
+            self.lookup_cache.put("sources", image_file_name, key)
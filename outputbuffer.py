@@ -0,0 +1,52 @@
+import io
+import sys
+import threading
+from contextlib import contextmanager
+
+
+class ThreadLocalStdout:
+    """
+    A sys.stdout replacement that sends writes from a capturing thread to
+    that thread's buffer and everything else to the real stdout.
+
+    Used to keep the output of a sector that is processed in a worker thread
+    together, instead of interleaving it with the other sectors.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(text)
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    @contextmanager
+    def capture(self):
+        buffer = io.StringIO()
+        self.local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self.local.buffer = None
+
+
+@contextmanager
+def thread_local_stdout():
+    """Install a ThreadLocalStdout as sys.stdout for the duration of the block."""
+    original_stdout = sys.stdout
+    stdout = ThreadLocalStdout(original_stdout)
+    sys.stdout = stdout
+    try:
+        yield stdout
+    finally:
+        sys.stdout = original_stdout
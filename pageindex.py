@@ -0,0 +1,87 @@
+import json
+import threading
+
+
+class PageIndex:
+    """
+    In-memory index of WordPress pages keyed by slug.
+
+    All pages are loaded with a single `wp post list` call so that slug
+    lookups do not need a WP-CLI round trip each. Pages created during the
+    run are added to the index with add_page().
+
+    With a LookupCache, the pages cached by earlier runs answer lookups, and
+    the pages are only loaded from WordPress when a slug is not cached.
+    """
+
+    FIELDS = "ID,post_name,post_parent,post_modified"
+
+    def __init__(self, wp_runner, post_type="page", lookup_cache=None):
+        self.wp_runner = wp_runner
+        self.post_type = post_type
+        self.lookup_cache = lookup_cache
+        self.pages_by_slug = {}
+        self.pages_by_id = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+        if lookup_cache is not None:
+            for slug, page in lookup_cache.get_all("pages").items():
+                self.pages_by_slug[slug] = page
+                self.pages_by_id[int(page["ID"])] = page
+
+    def load(self):
+        print("📀 Loading page index from WordPress...")
+        output = self.wp_runner.run_wp_cli(
+            f"wp post list --post_type={self.post_type} --posts_per_page=-1 "
+            f"--format=json --fields={self.FIELDS}"
+        )
+        pages_by_slug = {}
+        pages_by_id = {}
+        if output:
+            for page in json.loads(output):
+                # wp post list returns the newest page first. Keep the first
+                # page for a slug to match what `--name=<slug>` returned.
+                pages_by_slug.setdefault(page["post_name"], page)
+                pages_by_id[int(page["ID"])] = page
+        with self.lock:
+            self.pages_by_slug = pages_by_slug
+            self.pages_by_id = pages_by_id
+            self.loaded = True
+        if self.lookup_cache is not None:
+            self.lookup_cache.replace("pages", pages_by_slug)
+        print(f"✅ Page index loaded with {len(self.pages_by_slug)} pages.")
+
+    def load_unless_cached(self, slugs):
+        """Load the index, unless every one of slugs is already known."""
+        with self.lock:
+            cached = self.loaded or all(slug in self.pages_by_slug for slug in slugs)
+        if cached:
+            print("✅ Page index answered from the lookup cache.")
+        else:
+            self.load()
+
+    def get(self, slug):
+        """Get the page record (ID, post_name, post_parent, post_modified) for a slug."""
+        if not self.loaded and slug not in self.pages_by_slug:
+            self.load()
+        return self.pages_by_slug.get(slug)
+
+    def get_page_id(self, slug):
+        page = self.get(slug)
+        if page:
+            return page["ID"]
+        return None
+
+    def add_page(self, post_id, slug, parent_id=0, modified=""):
+        """Record a page created during this run so later lookups find it."""
+        page = {
+            "ID": int(post_id),
+            "post_name": slug,
+            "post_parent": int(parent_id or 0),
+            "post_modified": modified,
+        }
+        with self.lock:
+            self.pages_by_slug[slug] = page
+            self.pages_by_id[page["ID"]] = page
+        if self.lookup_cache is not None:
+            self.lookup_cache.put("pages", slug, page)
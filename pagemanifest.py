@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+
+MANIFEST_FILE_NAME = "elementor_manifest.json"
+
+
+def hash_value(value):
+    """Stable sha256 of a JSON serialisable value."""
+    if isinstance(value, str):
+        data = value
+    else:
+        data = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def payload_md5(payload):
+    # MD5 of the exact string stored in _elementor_data, so it can be compared
+    # with MD5(meta_value) computed by MySQL on the server
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+class PageManifest:
+    """
+    Record of what was last pushed to a page, stored next to
+    elementor_data.json in the page's data directory.
+
+    It holds the post ID, the MD5 of the pushed _elementor_data payload and a
+    hash of every input that went into it (text files, image IDs, services,
+    experts, tabs and the template), so that an unchanged page can be skipped
+    and a changed one reports which inputs differ.
+
+    The record is kept per host. A page pushed to one host is not skipped on
+    another host, even when its post ID is the same there.
+    """
+
+    def __init__(self, directory_path, host):
+        self.path = os.path.join(directory_path, MANIFEST_FILE_NAME)
+        self.host = host
+        # host -> {"post_id", "payload_md5", "inputs"}
+        self.hosts = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    # Manifests without a host are not trusted for any host
+                    self.hosts = json.load(f).get("hosts", {})
+            except ValueError:
+                print(f"❌ Invalid manifest {self.path}, ignoring it.")
+        self.data = self.hosts.get(host, {})
+
+    def is_unchanged(self, post_id, md5):
+        return (
+            str(self.data.get("post_id")) == str(post_id)
+            and self.data.get("payload_md5") == md5
+        )
+
+    def changed_inputs(self, inputs):
+        previous = self.data.get("inputs", {})
+        return sorted(
+            key
+            for key in set(previous) | set(inputs)
+            if previous.get(key) != inputs.get(key)
+        )
+
+    def save(self, post_id, md5, inputs):
+        self.data = {"post_id": post_id, "payload_md5": md5, "inputs": inputs}
+        self.hosts[self.host] = self.data
+        with open(self.path, "w") as f:
+            json.dump({"hosts": self.hosts}, f, indent=4, sort_keys=True)
+
+
+def fetch_remote_hashes(wp_runner, post_ids):
+    """
+    Get the MD5 of the current _elementor_data of many posts in one query.
+    Returns a dict of post ID (str) -> md5.
+    """
+    post_ids = sorted({int(post_id) for post_id in post_ids})
+    if not post_ids:
+        return {}
+    id_list = ",".join(str(post_id) for post_id in post_ids)
+    rows = wp_runner.run_sql_rows(
+        f"select post_id, md5(meta_value) from wppj_postmeta where meta_key='_elementor_data' and post_id in ({id_list});"
+    )
+    remote_hashes = {}
+    for row in rows:
+        if len(row) == 2:
+            remote_hashes[row[0]] = row[1]
+    return remote_hashes
@@ -1,74 +1,147 @@
 import csv
+import sys
+from operator import attrgetter
+
+# Keys that sector["key"] and sector.get("key") can read, so that old code
+# that uses sector_data["sector"] still works
+ITEM_GETTERS = {
+    key: attrgetter(key) for key in ("sector", "slug", "level", "subsector", "category")
+}
+# Number of names (sector, subsector, category) that identify a row of a level
+LEVEL_DEPTHS = {"L1": 1, "L2": 2, "L3": 3}
+
+
+def intern_name(value):
+    # The same sector and subsector names repeat on many rows, keep one copy
+    return sys.intern(value) if value else value
 
 
 class SectorData:
+    """
+    One row of the sector CSV.
+
+    Rows use __slots__ and are read only, except for experts, which
+    ExpertSectionCreator fills in. Names are interned, and the name, key,
+    parent key and data directory are computed once when the row is made.
+    """
+
+    __slots__ = (
+        "sector",
+        "slug",
+        "level",
+        "subsector",
+        "category",
+        "experts",
+        "name",
+        "key",
+        "parent_key",
+        "data_directory",
+    )
+    MUTABLE_FIELDS = frozenset(["experts"])
+
     def __init__(
         self, sector, slug, level, subsector=None, category=None, experts=None
     ):
-        self.sector = sector
-        self.slug = slug
-        self.level = level
-        self.subsector = subsector
-        self.category = category
-        if experts:
-            self.experts = experts
+        set_field = super().__setattr__
+        set_field("sector", intern_name(sector))
+        set_field("slug", slug)
+        set_field("level", intern_name(level))
+        set_field("subsector", intern_name(subsector))
+        set_field("category", intern_name(category))
+        # Initialize experts as an empty list if not provided
+        # This allows for easy appending later
+        set_field("experts", experts if experts else [])
+        names = (self.sector, self.subsector, self.category)
+        depth = LEVEL_DEPTHS.get(level)
+        if depth:
+            # The name of the sector, subsector, or category based on the level
+            set_field("name", names[depth - 1])
+            # (sector, subsector, category), with None for the levels below this one
+            set_field("key", names[:depth] + (None,) * (3 - depth))
+            set_field(
+                "parent_key",
+                names[: depth - 1] + (None,) * (4 - depth) if depth > 1 else None,
+            )
+            set_field(
+                "data_directory", "/".join(("redseer-sector-data",) + names[:depth])
+            )
         else:
-            # Initialize experts as an empty list if not provided
-            # This allows for easy appending later
-            self.experts = []
+            for field in ("name", "key", "parent_key", "data_directory"):
+                set_field(field, None)
+
+    def __setattr__(self, field, value):
+        if field not in self.MUTABLE_FIELDS:
+            raise AttributeError(f"SectorData.{field} is read only")
+        super().__setattr__(field, value)
 
     def get_data_directory(self):
         # Get the directory path for the sector data based on the level
-        if self.level == "L1":
-            return f"redseer-sector-data/{self.sector}"
-        elif self.level == "L2":
-            return f"redseer-sector-data/{self.sector}/{self.subsector}"
-        elif self.level == "L3":
-            return f"redseer-sector-data/{self.sector}/{self.subsector}/{self.category}"
-        return None
-
-    # Make this a property so that it can be accessed as sector_data.name
-    @property
-    def name(self):
-        """Get the name of the sector, subsector, or category based on the level."""
-        if self.level == "L1":
-            return self.sector
-        elif self.level == "L2":
-            return self.subsector
-        elif self.level == "L3":
-            return self.category
-        return None
+        return self.data_directory
 
     def __repr__(self):
         return f"SectorData(sector={self.sector}, slug={self.slug}, level={self.level}, subsector={self.subsector}, category={self.category})"
 
-    # Support key based access to the properties so that old code
-    # that uses sector_data["sector"] still works
     def __getitem__(self, key):
-        if key == "sector":
-            return self.sector
-        elif key == "slug":
-            return self.slug
-        elif key == "level":
-            return self.level
-        elif key == "subsector":
-            return self.subsector
-        elif key == "category":
-            return self.category
-        else:
+        getter = ITEM_GETTERS.get(key)
+        if getter is None:
             raise KeyError(f"Invalid key: {key}")
+        return getter(self)
 
     # Add a get method too
     def get(self, key, default=None):
         """Get the value of the specified key, or return default if not found."""
-        try:
-            retval = self[key]
-            if retval is None:
-                return default
-            else:
-                return retval
-        except KeyError:
+        getter = ITEM_GETTERS.get(key)
+        if getter is None:
             return default
+        value = getter(self)
+        return default if value is None else value
+
+
+class SectorTree:
+    """
+    The sector rows of the CSV with indexes for the hierarchy.
+
+    Iterating gives the rows in CSV order, like the list load_sector_data
+    used to return. A row's parent and children are found in constant
+    time, so lookups do not scan the whole taxonomy. Children are looked
+    up under their parent, so a subsector or category name used under two
+    parents resolves to the right row.
+    """
+
+    def __init__(self, sectors):
+        self.sectors = list(sectors)
+        self.by_key = {}
+        # parent key -> child rows in CSV order
+        self.children = {}
+        # (parent key, child name) -> child row
+        self.children_by_name = {}
+        for sector in self.sectors:
+            # The first row wins, as with the scans this replaces
+            self.by_key.setdefault(sector.key, sector)
+            parent_key = sector.parent_key
+            if parent_key is not None:
+                self.children.setdefault(parent_key, []).append(sector)
+                self.children_by_name.setdefault((parent_key, sector.name), sector)
+
+    def __iter__(self):
+        return iter(self.sectors)
+
+    def __len__(self):
+        return len(self.sectors)
+
+    def __getitem__(self, index):
+        return self.sectors[index]
+
+    def get_parent(self, sector):
+        parent_key = sector.parent_key
+        return self.by_key.get(parent_key) if parent_key is not None else None
+
+    def get_children(self, sector):
+        return self.children.get(sector.key, [])
+
+    def get_child(self, sector, name):
+        """The child of sector called name (a subsector of an L1, a category of an L2)."""
+        return self.children_by_name.get((sector.key, name))
 
 
 def load_sector_data(sector_file):
@@ -141,7 +214,7 @@ def load_sector_data(sector_file):
                     experts=experts,
                 )
             )
-    return validated_data
+    return SectorTree(validated_data)
 
 
 if __name__ == "__main__":
@@ -1,14 +1,39 @@
+import gzip
 import json
-import shlex
 import os
 import argparse
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from slugify import slugify
 from jsonupdator import JSONUpdator
+from outputbuffer import thread_local_stdout
+from instrumentation import tracer
 from wpcommandrunner import WPCommandRunner
+from fakewprunner import FakeWPCommandRunner
+from asyncwpcommandrunner import (
+    AsyncWPCommandRunner,
+    BlockingWPCommandRunner,
+    start_event_loop,
+)
 from wpimagecreator import WPImageCreator
+from cacheinvalidator import CacheInvalidator
+from imagecache import ImageCache
+from lookupcache import LookupCache
+from pageindex import PageIndex
+from pagemanifest import PageManifest, fetch_remote_hashes, hash_value, payload_md5
+from templatecache import TEMPLATE_SLUGS, TemplateCache
+from snapshotstore import SnapshotStore
+from syncplanner import SyncPlanner, load_plan, save_plan
+from syncstate import SyncState, get_affected_slugs, scan_files, wait_for_changes
 from sectordataloader import load_sector_data
 from sectortabcreator import SectorTabCreator
-from servicescontentcreator import ServicesContentCreator
+from servicescontentcreator import (
+    ServicesContentCreator,
+    get_service_image_jobs,
+    get_services,
+)
 from expertsectioncreator import ExpertSectionCreator
 
 
@@ -20,25 +45,71 @@ class SectorManager:
         wp_host="staging.redseer.com",
         levels=["L1", "L2", "L3"],
         sync_json=False,
+        jobs=1,
+        verify_remote=False,
+        image_cache=None,
+        upload_images=True,
+        incremental=False,
+        expert_roles=None,
+        lookup_cache=None,
     ):
         self.wp_host = wp_host
+        self.sector_file = sector_file
         self.levels = levels
         self.wp_runner = wp_runner
         self.sync_json = sync_json
+        self.jobs = max(1, jobs)
+        self.verify_remote = verify_remote
+        # post ID -> MD5 of its _elementor_data on the server, see verify_remote
+        self.remote_hashes = {}
+        # slug -> MD5 of the content a plan rendered, only that is written
+        self.planned_hashes = {}
+        # IDs of pages, images and experts found by earlier runs. Expired
+        # entries are checked in one query. The post_modified of the
+        # templates is always asked from the server, see TemplateCache.
+        self.lookup_cache = (
+            lookup_cache if lookup_cache is not None else LookupCache(wp_host)
+        )
+        self.lookup_cache.revalidate(self.wp_runner)
+        self.page_index = PageIndex(self.wp_runner, lookup_cache=self.lookup_cache)
+        self.template_cache = TemplateCache(self.wp_runner)
+        self.cache_invalidator = CacheInvalidator(self.wp_runner)
+        # With incremental, only the pages whose content changed since the
+        # last successful sync are synced. The content is scanned before it
+        # is read, so an edit made during the run is picked up by the next.
+        self.incremental = incremental
+        self.only_slugs = None
+        self.scanned_files = None
+        # Slugs of the pages that were not synced completely by this run
+        self.failed_slugs = set()
+        self.failed_lock = threading.Lock()
+        if incremental:
+            self.sync_state = SyncState(wp_host)
+            self.scanned_files = self.sync_state.scan(sector_file)
         print("📀 Loading sector data from file:", sector_file)
         self.sector_data = load_sector_data(sector_file)
         print("✅ Sector data loaded successfully.")
         self.create_content_directories()
         print("📂 Content directories created successfully.")
-        self.image_creator = WPImageCreator(self.wp_runner)
+        # Without upload_images, images are only looked up, see SyncPlanner
+        self.image_creator = WPImageCreator(
+            self.wp_runner,
+            image_cache,
+            lookup_only=not upload_images,
+            lookup_cache=self.lookup_cache,
+        )
         self.sector_tab_creator = SectorTabCreator(
             self.sector_data, self.image_creator, wp_host
         )
+        if not incremental:
+            # With incremental, the images are prepared once the pages to
+            # sync are known, so only the images of those pages are processed
+            self.prepare_images()
         self.services_content_creator = ServicesContentCreator(
-            self.wp_runner, self.image_creator
+            self.wp_runner, self.image_creator, self.lookup_cache
         )
         self.expert_section_creator = ExpertSectionCreator(
-            self.sector_data, self.wp_runner
+            self.sector_data, self.wp_runner, expert_roles, self.lookup_cache
         )
 
     def create_content_directories(self):
@@ -98,58 +169,386 @@ class SectorManager:
             else:
                 print(f"✅ File already exists: {file_path}")
 
+    def get_image_updates(self, sector):
+        # The images of a page, as updates for update_page_content
+        image_updates = [
+            {
+                "path": "[0].settings.background_image",
+                "image-file": "hero.jpg",
+                "image-file-name": f"{slugify(sector.name)}-hero-image-optimized.jpg",
+            },
+        ]
+        if sector.level in ["L2", "L3"]:
+            image_updates.append(
+                {
+                    "path": "[2].elements.[0].settings.image",
+                    "image-file": "second-fold-descrition.jpg",
+                    "image-file-name": f"{slugify(sector.name)}-second-fold-image-optimized.jpg",
+                }
+            )
+        return image_updates
+
+    def prepare_images(self):
+        # Optimize every image this run needs in parallel before the page
+        # loop: hero and second fold images, tab images and service images.
+        # Then upload the ones missing from the media library in one batch.
+        if self.image_creator.lookup_only:
+            # The images are only looked up, e.g. for a plan or --offline
+            return
+        image_jobs = self.get_image_jobs()
+        with tracer.span("phase.images", images=len(image_jobs)):
+            self.image_creator.prepare_images(image_jobs)
+
+    def get_image_jobs(self):
+        # (source image, optimized image name, width) of every image of the run
+        image_jobs = []
+        if not self.sync_json:
+            # Only the services shown on the pages of the run
+            image_jobs = get_service_image_jobs(
+                get_services(self.get_sectors_to_sync())
+            )
+            for sector in self.get_sectors_to_sync():
+                directory_path = sector.get_data_directory()
+                for update in self.get_image_updates(sector):
+                    image_jobs.append(
+                        (
+                            os.path.join(directory_path, update["image-file"]),
+                            update["image-file-name"],
+                            1440,
+                        )
+                    )
+                if sector.level in ["L1", "L2"]:
+                    image_jobs.extend(
+                        self.sector_tab_creator.get_tab_image_jobs(
+                            sector, directory_path
+                        )
+                    )
+        return image_jobs
+
     def create_sector_pages(self):
+        with tracer.span("phase.prefetch"):
+            # Load every page once so that the slug lookups below are answered
+            # from memory instead of a `wp post list` call each
+            self.page_index.load_unless_cached(self.get_page_slugs())
+            page_ids_by_level, parent_page_id = self.get_template_and_parent_page_ids()
+            if self.incremental:
+                self.find_changed_pages(page_ids_by_level)
+            self.load_remote_hashes()
+            # Fetch the templates up front so that worker threads share them
+            for template_page_id in page_ids_by_level.values():
+                self.template_cache.get_elementor_data(template_page_id)
+        if self.incremental:
+            self.prepare_images()
+        print("🛠️ Creating/updating sector pages...")
+        sectors = self.get_sectors_to_sync()
+        try:
+            with tracer.span("phase.pages", pages=len(sectors)):
+                if self.jobs > 1:
+                    self.sync_sectors_in_parallel(
+                        sectors, page_ids_by_level, parent_page_id
+                    )
+                else:
+                    for sector in sectors:
+                        self.sync_sector(sector, page_ids_by_level, parent_page_id)
+        finally:
+            # Pages written before a failure are in their manifest, so the
+            # next run skips them: their caches have to be invalidated now
+            with tracer.span("phase.invalidate"):
+                self.invalidate_caches()
+        if self.incremental:
+            self.save_sync_state(page_ids_by_level)
+        self.image_creator.image_cache.save()
+        self.lookup_cache.save()
+
+    def render_sector_pages(self):
+        """
+        Write the Elementor data of every page of the run to its
+        elementor_data.json, without creating or updating anything in
+        WordPress. With --offline this runs against a SnapshotStore.
+        """
+        page_ids_by_level, _ = self.get_template_and_parent_page_ids()
+        if self.incremental:
+            self.prepare_images()
+        sectors = self.get_sectors_to_sync()
+        print(f"🛠️ Rendering {len(sectors)} sector pages...")
+        with tracer.span("phase.pages", pages=len(sectors)):
+            for sector in sectors:
+                with tracer.span("page", sector=sector.slug, level=sector.level):
+                    directory_path = sector.get_data_directory()
+                    elementor_data, _ = self.render_page(
+                        page_ids_by_level[sector.level], directory_path, sector
+                    )
+                    with open(f"{directory_path}/elementor_data.json", "w") as f:
+                        json.dump(elementor_data, f, indent=4)
+        self.image_creator.image_cache.save()
+        print(f"✅ Rendered {len(sectors)} pages.")
+
+    async def create_sector_pages_async(self, concurrency=8):
+        """
+        Same as create_sector_pages, for a SectorManager whose wp_runner is a
+        BlockingWPCommandRunner. The bulk lookups and up to `concurrency`
+        sectors run at the same time, and their remote calls are pipelined
+        on the event loop of the async runner.
+        """
+        # Everything that may call the wp_runner runs in a thread. The
+        # BlockingWPCommandRunner waits on this loop, so a call made on it
+        # would never return.
+        await asyncio.to_thread(
+            self.page_index.load_unless_cached, self.get_page_slugs()
+        )
+        page_ids_by_level, parent_page_id = await asyncio.to_thread(
+            self.get_template_and_parent_page_ids
+        )
+        if self.incremental:
+            await asyncio.to_thread(self.find_changed_pages, page_ids_by_level)
+            await asyncio.to_thread(self.prepare_images)
+        await asyncio.gather(
+            asyncio.to_thread(self.load_remote_hashes),
+            *(
+                asyncio.to_thread(self.template_cache.get_elementor_data, page_id)
+                for page_id in page_ids_by_level.values()
+            ),
+        )
+        sectors = self.get_sectors_to_sync()
+        print(f"🛠️ Creating/updating {len(sectors)} sector pages concurrently...")
+        semaphore = asyncio.Semaphore(concurrency)
+        with thread_local_stdout() as stdout:
+
+            async def sync_sector(sector):
+                async with semaphore:
+                    return await asyncio.to_thread(
+                        self.sync_sector_buffered,
+                        stdout,
+                        sector,
+                        page_ids_by_level,
+                        parent_page_id,
+                    )
+
+            results = await asyncio.gather(*(sync_sector(s) for s in sectors))
+        errors = []
+        for output, error in results:
+            print(output, end="")
+            if error is not None:
+                errors.append(error)
+        # Also after a failure, see create_sector_pages
+        await asyncio.to_thread(self.invalidate_caches)
+        if errors:
+            raise errors[0]
+        if self.incremental:
+            await asyncio.to_thread(self.save_sync_state, page_ids_by_level)
+        self.image_creator.image_cache.save()
+        self.lookup_cache.save()
+
+    def get_page_slugs(self):
+        # Slugs of every page a run looks up
+        return (
+            TEMPLATE_SLUGS
+            + ["industries"]
+            + [
+                sector.slug
+                for sector in self.sector_data
+                if sector.level in self.levels
+            ]
+        )
+
+    def get_template_and_parent_page_ids(self):
         # Load the page templates for each level
         print("📀 Loading template pages for sector levels...")
         page_ids_by_level = {}
-        for level in range(1, 4):
-            page_id = self.get_page_id_by_slug(f"sector-level-{level}")
+        for level, slug in enumerate(TEMPLATE_SLUGS, 1):
+            page_id = self.get_page_id_by_slug(slug)
             if not page_id:
                 raise ValueError(f"Template page for sector level {level} not found.")
             page_ids_by_level[f"L{level}"] = page_id
         print(page_ids_by_level)
+        # A template edited since the page index was loaded is fetched again
+        self.template_cache.load_modified(page_ids_by_level.values())
         print("✅ Template pages loaded successfully.")
         print("📀 Loading parent page ID for industries...")
         parent_page_id = self.get_page_id_by_slug("industries")
         print("✅ Parent page ID for industries:", parent_page_id)
-        print("🛠️ Creating/updating sector pages...")
-        for sector in self.sector_data:
-            if sector.level not in self.levels:
-                continue
-            slug = sector["slug"]
-            post_id = ""
-            template_page_id = page_ids_by_level[sector.level]
-            # Check if the page already exists
-            existing_page_id = self.get_page_id_by_slug(slug)
-            if existing_page_id:
-                print(
-                    f"📄 Page with slug '{slug}' already exists with ID {existing_page_id}."
-                )
-                post_id = existing_page_id
-            else:
-                print(f"🛠️ Creating page for {sector.level} with slug '{slug}'")
-                post_title = sector.name
-                post_id = self.wp_runner.run_wp_cli(
-                    f"wp post create --porcelain --post_type=page --post_title='{post_title}' "
-                    f"--post_name='{slug}' --post_parent={parent_page_id} --from-post={template_page_id}"
-                )
-                if post_id:
-                    print(f"✨ Created page with ID {post_id} for slug '{slug}'")
-                else:
-                    print(f"❌ Failed to create page for slug '{slug}'")
+        return page_ids_by_level, parent_page_id
+
+    def load_remote_hashes(self):
+        if self.verify_remote and not self.sync_json:
+            print("📀 Loading content hashes of existing pages...")
+            post_ids = [
+                self.get_page_id_by_slug(sector.slug)
+                for sector in self.get_sectors_to_sync()
+            ]
+            self.remote_hashes = fetch_remote_hashes(
+                self.wp_runner, [post_id for post_id in post_ids if post_id]
+            )
+
+    def get_sectors_to_sync(self):
+        return [
+            sector
+            for sector in self.sector_data
+            if sector.level in self.levels
+            and (self.only_slugs is None or sector.slug in self.only_slugs)
+        ]
+
+    def get_template_versions(self, page_ids_by_level):
+        return {
+            level: self.template_cache.get_modified(page_id)
+            for level, page_id in page_ids_by_level.items()
+        }
+
+    def find_changed_pages(self, page_ids_by_level):
+        # Limit the sync to the pages that depend on a file that changed, or
+        # whose template page was modified, since the last successful sync,
+        # and to the pages that failed in it
+        changed_files = self.sync_state.changed_files(self.scanned_files)
+        changed_levels = self.sync_state.changed_templates(
+            self.get_template_versions(page_ids_by_level)
+        )
+        sectors = self.get_sectors_to_sync()
+        slugs = get_affected_slugs(sectors, changed_files, self.sector_file)
+        slugs.update(
+            sector.slug
+            for sector in sectors
+            if sector.level in changed_levels
+            or sector.slug in self.sync_state.failed_slugs
+        )
+        print(
+            f"🔍 {len(changed_files)} changed files and {len(changed_levels)} changed "
+            f"templates affect {len(slugs)} pages."
+        )
+        self.only_slugs = slugs
+
+    def save_sync_state(self, page_ids_by_level):
+        if set(self.levels) != {"L1", "L2", "L3"} or self.sync_json:
+            # Pages of the other levels may still depend on the changes
+            print("⏭️ Not saving the sync state of a partial run.")
+            return
+        if self.failed_slugs:
+            print(
+                f"❌ {len(self.failed_slugs)} pages failed, they are synced again "
+                "next time."
+            )
+        self.sync_state.save(
+            self.scanned_files,
+            self.get_template_versions(page_ids_by_level),
+            self.failed_slugs,
+        )
+        print("💾 Sync state saved.")
+
+    def record_failure(self, sector):
+        with self.failed_lock:
+            self.failed_slugs.add(sector.slug)
+
+    def invalidate_caches(self):
+        # Regenerate the Elementor CSS of the written pages, so that they are
+        # styled correctly, and purge them from the page cache
+        self.cache_invalidator.invalidate()
+
+    def get_page_urls(self, sector):
+        # The URL of a sector page and of the parent page that lists it in
+        # its tabs, see SectorTabCreator
+        sectors = [sector, self.sector_data.get_parent(sector)]
+        return [
+            f"https://{self.wp_host}/industries/{page.slug}/"
+            for page in sectors
+            if page is not None
+        ]
+
+    def sync_sector(self, sector, page_ids_by_level, parent_page_id):
+        with tracer.span("page", sector=sector.slug, level=sector.level):
+            self.sync_page(sector, page_ids_by_level, parent_page_id)
+
+    def sync_page(self, sector, page_ids_by_level, parent_page_id):
+        slug = sector["slug"]
+        post_id = ""
+        template_page_id = page_ids_by_level[sector.level]
+        # Check if the page already exists
+        existing_page_id = self.get_page_id_by_slug(slug)
+        if existing_page_id:
+            print(
+                f"📄 Page with slug '{slug}' already exists with ID {existing_page_id}."
+            )
+            post_id = existing_page_id
+        else:
+            print(f"🛠️ Creating page for {sector.level} with slug '{slug}'")
+            post_title = sector.name
+            post_id = self.wp_runner.run_wp_cli(
+                f"wp post create --porcelain --post_type=page --post_title='{post_title}' "
+                f"--post_name='{slug}' --post_parent={parent_page_id} --from-post={template_page_id}"
+            )
             if post_id:
-                # Update the page with the content from the text files
-                directory_path = sector.get_data_directory()
-                self.update_page_content(
-                    template_page_id, post_id, directory_path, sector
-                )
-        # Flush the Elementor CSS cache to ensure the new pages are styled correctly
-        print("🧹 Flushing Elementor CSS cache...")
-        self.wp_runner.run_wp_cli("wp elementor flush_css")
-        self.wp_runner.run_wp_cli("wp w3-total-cache flush all")
+                print(f"✨ Created page with ID {post_id} for slug '{slug}'")
+                self.page_index.add_page(post_id, slug, parent_page_id)
+            else:
+                print(f"❌ Failed to create page for slug '{slug}'")
+                self.record_failure(sector)
+        if post_id:
+            # Update the page with the content from the text files
+            directory_path = sector.get_data_directory()
+            self.update_page_content(template_page_id, post_id, directory_path, sector)
+
+    def sync_sectors_in_parallel(self, sectors, page_ids_by_level, parent_page_id):
+        # Sectors are independent of each other, so they are synced by a pool
+        # of worker threads. The output of every sector is buffered and
+        # printed in CSV order once that sector is done.
+        print(f"🧵 Syncing {len(sectors)} pages with {self.jobs} workers...")
+        errors = []
+        with thread_local_stdout() as stdout:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                for output, error in executor.map(
+                    lambda sector: self.sync_sector_buffered(
+                        stdout, sector, page_ids_by_level, parent_page_id
+                    ),
+                    sectors,
+                ):
+                    print(output, end="")
+                    if error is not None:
+                        errors.append(error)
+        if errors:
+            raise errors[0]
+
+    def sync_sector_buffered(self, stdout, sector, page_ids_by_level, parent_page_id):
+        # Sync a sector in a worker thread, capturing its output.
+        # Returns (output, exception or None).
+        with stdout.capture() as buffer:
+            try:
+                self.sync_sector(sector, page_ids_by_level, parent_page_id)
+                error = None
+            except Exception as e:
+                print(f"❌ Failed to sync page '{sector['slug']}': {e!r}")
+                self.record_failure(sector)
+                error = e
+        return buffer.getvalue(), error
 
     def update_page_content(self, template_page_id, post_id, directory_path, sector):
+        with tracer.span("page.update", post_id=post_id):
+            self.update_page_elementor_data(
+                template_page_id, post_id, directory_path, sector
+            )
+
+    def update_page_elementor_data(
+        self, template_page_id, post_id, directory_path, sector
+    ):
         print(f"🔄 Updating content for post ID {post_id} in {directory_path}")
+        elementor_data, inputs = self.render_page(
+            template_page_id, directory_path, sector
+        )
+        if not self.sync_json:
+            self.write_page_content(
+                post_id, directory_path, elementor_data, inputs, sector
+            )
+        # Save the elementor data to a JSON file in the directory for debugging.
+        with open(f"{directory_path}/elementor_data.json", "w") as f:
+            json.dump(elementor_data, f, indent=4)
+
+    def render_page(self, template_page_id, directory_path, sector):
+        """
+        Build the Elementor data of a page from its template and local
+        content. Returns (elementor_data, hashes of the inputs), or the
+        template as is and None with sync_json.
+        """
+        if self.sync_json:
+            # The tabs, services and experts would not be used
+            return self.template_cache.get_elementor_data(template_page_id), None
+        inputs = None
         if sector.level == "L1":
             subsector_list = self.sector_tab_creator.create_tab_content(
                 sector, directory_path
@@ -170,11 +569,6 @@ class SectorManager:
                     "path": "[0].elements.[0].elements.[2].settings.editor",
                     "value-file": "hero-byline.txt",
                 },
-                {
-                    "path": "[0].settings.background_image",
-                    "image-file": "hero.jpg",
-                    "image-file-name": f"{slugify(sector.name)}-hero-image-optimized.jpg",
-                },
                 {
                     "path": "[2].elements.[0].settings.title",
                     "value": f"Our {sector.name} Consulting Services",
@@ -216,20 +610,10 @@ class SectorManager:
                     "path": "[0].elements.[0].elements.[1].settings.editor",
                     "value-file": "hero-heading.txt",
                 },
-                {
-                    "path": "[0].settings.background_image",
-                    "image-file": "hero.jpg",
-                    "image-file-name": f"{slugify(sector.name)}-hero-image-optimized.jpg",
-                },
                 {
                     "path": "[2].elements.[1].settings.editor",
                     "value-file": "second-fold-description.txt",
                 },
-                {
-                    "path": "[2].elements.[0].settings.image",
-                    "image-file": "second-fold-descrition.jpg",
-                    "image-file-name": f"{slugify(sector.name)}-second-fold-image-optimized.jpg",
-                },
                 {
                     "path": "[3].elements.[0].settings.editor",
                     "value": f"Explore {sector.name} Subsectors",
@@ -268,20 +652,10 @@ class SectorManager:
                     "path": "[0].elements.[0].elements.[1].settings.editor",
                     "value-file": "hero-heading.txt",
                 },
-                {
-                    "path": "[0].settings.background_image",
-                    "image-file": "hero.jpg",
-                    "image-file-name": f"{slugify(sector.name)}-hero-image-optimized.jpg",
-                },
                 {
                     "path": "[2].elements.[1].settings.editor",
                     "value-file": "second-fold-description.txt",
                 },
-                {
-                    "path": "[2].elements.[0].settings.image",
-                    "image-file": "second-fold-descrition.jpg",
-                    "image-file-name": f"{slugify(sector.name)}-second-fold-image-optimized.jpg",
-                },
                 {
                     "path": "[5].elements.[0].elements.[0].settings.title",
                     "value": f"<p>{sector.name} Experts</p>",
@@ -295,17 +669,26 @@ class SectorManager:
                     "value": self.expert_section_creator.get_widget_code(sector),
                 },
             ]
-        # Get the elementor content for the hero section
-        elementor_data = self.wp_runner.run_wp_cli(
-            f"wp post meta get {template_page_id} _elementor_data"
-        )
-        elementor_data = json.loads(elementor_data)
+        updates.extend(self.get_image_updates(sector))
+        # Get a fresh copy of the template's elementor content. The template
+        # is only fetched from WordPress the first time it is used.
+        elementor_data = self.template_cache.get_elementor_data(template_page_id)
 
         if not self.sync_json:
             # If sync_json is False, we will update the page content
             # else, we just want to update the JSON files in the directory
             # Update the hero heading and byline for L1
             updator = JSONUpdator(elementor_data)
+            resolved_updates = []
+            # Hash every input so the manifest can tell what changed
+            inputs = {
+                "template": hash_value(
+                    [
+                        template_page_id,
+                        self.template_cache.get_modified(template_page_id),
+                    ]
+                )
+            }
             for update in updates:
                 if "value-file" in update:
                     file_path = os.path.join(directory_path, update["value-file"])
@@ -323,6 +706,7 @@ class SectorManager:
                         print(
                             f"❌ Failed to create or find image {optimized_image_name}"
                         )
+                        self.record_failure(sector)
                         continue
                     value = {
                         "url": f"https://{self.wp_host}/wp-content/uploads/{image_url}",
@@ -333,24 +717,57 @@ class SectorManager:
                     }
                 else:
                     value = update["value"]
-                updator.update_json(update["path"], value)
-            if updates:
-                self.wp_runner.run_wp_cli(
-                    f"wp post meta update {post_id} _elementor_data "
-                    + shlex.quote(json.dumps(elementor_data))
-                )
-        # Save the elementor data to a JSON file in the directory for debugging.
-        with open(f"{directory_path}/elementor_data.json", "w") as f:
-            json.dump(elementor_data, f, indent=4)
+                inputs[update["path"]] = hash_value(value)
+                resolved_updates.append((update["path"], value))
+            updator.apply_updates(resolved_updates)
+        return elementor_data, inputs
+
+    def write_page_content(
+        self, post_id, directory_path, elementor_data, inputs, sector
+    ):
+        # Skip the write when the page is exactly what was pushed last time,
+        # and, with verify_remote, is still what is stored on the server.
+        payload = json.dumps(elementor_data)
+        md5 = payload_md5(payload)
+        planned_md5 = self.planned_hashes.get(sector.slug)
+        if planned_md5 and planned_md5 != md5:
+            print(
+                f"❌ Content for post ID {post_id} is not what the plan rendered, "
+                "skipping update."
+            )
+            self.record_failure(sector)
+            return False
+        manifest = PageManifest(directory_path, self.wp_host)
+        remote_md5 = self.remote_hashes.get(str(post_id))
+        unchanged = manifest.is_unchanged(post_id, md5) and (
+            not self.verify_remote or remote_md5 == md5
+        )
+        tracer.cache("page_manifest", unchanged)
+        if unchanged:
+            print(f"⏭️ Content for post ID {post_id} is unchanged, skipping update.")
+            return False
+        if self.verify_remote and remote_md5 == md5:
+            print(f"⏭️ Content for post ID {post_id} already on the server.")
+        else:
+            changed_inputs = manifest.changed_inputs(inputs)
+            if manifest.data and changed_inputs:
+                print(f"🔄 Changed inputs for post ID {post_id}: {changed_inputs}")
+            # Stream the gzipped JSON over stdin instead of passing it as a
+            # shell argument, which is bounded by ARG_MAX. `wp post meta update`
+            # reads the value from STDIN when it is omitted. With pipefail a
+            # failed decompression fails the command, instead of storing the
+            # partial output.
+            self.wp_runner.run_wp_cli(
+                f"set -o pipefail; gzip -dc | wp post meta update {post_id} _elementor_data",
+                stdin=gzip.compress(payload.encode("utf-8")),
+            )
+            self.cache_invalidator.record(post_id, self.get_page_urls(sector))
+        manifest.save(post_id, md5, inputs)
+        return True
 
     def get_page_id_by_slug(self, slug):
-        command = f"wp post list --post_type=page --format=json --name={slug}"
-        output = self.wp_runner.run_wp_cli(command)
-        if output:
-            pages = json.loads(output)
-            if pages:
-                return pages[0]["ID"]
-        return None
+        # Answered from the page index, which loads every page in one call
+        return self.page_index.get_page_id(slug)
 
 
 if __name__ == "__main__":
@@ -387,13 +804,205 @@ if __name__ == "__main__":
         action="store_true",
         help="Do not create the pages, just sync the JSON files (default: False)",
     )
+    parser.add_argument(
+        "--persistent-session",
+        action="store_true",
+        help="Run wp commands through one long lived WP-CLI process (default: False)",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of pages to sync in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--verify-remote",
+        action="store_true",
+        help="Compare unchanged pages with the content on the server (default: False)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["fabric", "asyncssh", "fake"],
+        default="fabric",
+        help="Remote execution backend, fake runs against an in-memory WordPress (default: fabric)",
+    )
+    parser.add_argument(
+        "--plan",
+        type=str,
+        default=None,
+        help="Write the changes a sync would make to this file, without making them",
+    )
+    parser.add_argument(
+        "--apply-plan",
+        type=str,
+        default=None,
+        help="Make the changes of a plan written with --plan",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only sync the pages whose content changed since the last sync (default: False)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and sync incrementally whenever the content changes (default: False)",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=2.0,
+        help="Seconds between checks for changes with --watch (default: 2)",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="Write timing spans of the run to this JSON lines file",
+    )
+    parser.add_argument(
+        "--expert-role",
+        type=str,
+        default=None,
+        help="Comma-separated roles of the users experts are looked up in (default: all but subscriber)",
+    )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Discard the page, image and user IDs cached for the host (default: False)",
+    )
+    parser.add_argument(
+        "--snapshot-pull",
+        action="store_true",
+        help="Save the templates, users and media index of the host for --offline",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Render every page's elementor_data.json from the host's snapshot, without connecting",
+    )
+    parser.add_argument(
+        "--fake-latency",
+        type=float,
+        default=0.0,
+        help="Seconds every command takes with the fake backend (default: 0)",
+    )
     args = parser.parse_args()
-    wp_runner = WPCommandRunner(args.host, args.user, args.port)
-    sector_manager = SectorManager(
-        wp_runner,
-        "redseer-sector-pages.csv",
-        args.host,
-        levels=[x.strip().upper() for x in args.level.split(",")],
-        sync_json=args.sync_json,
+    if args.trace:
+        tracer.open(args.trace)
+    image_cache = None
+    lookup_cache = None
+    expert_roles = (
+        [x.strip() for x in args.expert_role.split(",")] if args.expert_role else None
     )
-    sector_manager.create_sector_pages()
+    if args.offline:
+        # Pages, users and images come from the snapshot. Its IDs are kept
+        # out of the lookup cache, they may be out of date.
+        wp_runner = SnapshotStore(args.host).create_runner()
+        lookup_cache = LookupCache(
+            args.host, os.path.join(tempfile.mkdtemp(), "lookup-cache.json")
+        )
+    elif args.backend == "fake":
+        # Nothing leaves the machine. The fake site has the sector templates,
+        # and a user for every expert in the CSV, so the whole sync can run.
+        wp_runner = FakeWPCommandRunner(latency=args.fake_latency)
+        wp_runner.add_sector_templates()
+        experts = set()
+        for sector in load_sector_data("redseer-sector-pages.csv"):
+            experts.update(sector.experts)
+        for expert in sorted(experts):
+            wp_runner.add_user(slugify(expert), expert)
+        # Keep the fake run out of the real image and lookup caches
+        cache_directory = tempfile.mkdtemp()
+        image_cache = ImageCache(os.path.join(cache_directory, "image-cache.json"))
+        lookup_cache = LookupCache(
+            args.host, os.path.join(cache_directory, "lookup-cache.json")
+        )
+    elif args.backend == "asyncssh":
+        # The async runner lives on an event loop in a background thread.
+        # SectorManager talks to it through the blocking wrapper.
+        loop = start_event_loop()
+        async_runner = AsyncWPCommandRunner(
+            args.host, args.user, args.port, max_concurrency=max(8, args.jobs)
+        )
+        asyncio.run_coroutine_threadsafe(async_runner.connect(), loop).result()
+        wp_runner = BlockingWPCommandRunner(async_runner, loop)
+    else:
+        wp_runner = WPCommandRunner(
+            args.host,
+            args.user,
+            args.port,
+            use_session=args.persistent_session,
+            pool_size=args.jobs,
+        )
+
+    if lookup_cache is None:
+        lookup_cache = LookupCache(args.host, refresh=args.refresh_cache)
+
+    def create_sector_manager():
+        return SectorManager(
+            wp_runner,
+            "redseer-sector-pages.csv",
+            args.host,
+            levels=[x.strip().upper() for x in args.level.split(",")],
+            sync_json=args.sync_json,
+            jobs=args.jobs,
+            verify_remote=args.verify_remote,
+            image_cache=image_cache,
+            upload_images=not (args.plan or args.apply_plan or args.offline),
+            incremental=args.incremental or args.watch,
+            expert_roles=expert_roles,
+            lookup_cache=lookup_cache,
+        )
+
+    def sync(sector_manager):
+        if args.offline:
+            sector_manager.render_sector_pages()
+        elif args.backend == "asyncssh":
+            asyncio.run_coroutine_threadsafe(
+                sector_manager.create_sector_pages_async(max(1, args.jobs)), loop
+            ).result()
+        else:
+            sector_manager.create_sector_pages()
+
+    scanned_files = None
+    try:
+        if args.snapshot_pull:
+            SnapshotStore(args.host).pull(wp_runner, expert_roles)
+        elif args.plan:
+            planner = SyncPlanner(create_sector_manager())
+            plan = planner.build_plan()
+            planner.print_plan(plan)
+            save_plan(plan, args.plan)
+            print(f"💾 Plan saved to {args.plan}")
+        elif args.apply_plan:
+            SyncPlanner(create_sector_manager()).apply_plan(load_plan(args.apply_plan))
+        else:
+            sector_manager = create_sector_manager()
+            scanned_files = sector_manager.scanned_files
+            sync(sector_manager)
+        while args.watch:
+            # Polls, so that it works the same on every platform and
+            # needs no extra package. Changes are looked for since the scan
+            # the last sync started with.
+            if scanned_files is None:
+                scanned_files = scan_files("redseer-sector-pages.csv", {})
+            print(f"👀 Watching for changes every {args.watch_interval}s...")
+            changed_files = wait_for_changes(
+                "redseer-sector-pages.csv", scanned_files, args.watch_interval
+            )
+            print(f"🔔 Changed: {', '.join(changed_files)}")
+            scanned_files = None
+            try:
+                # Load the content again, it may be the CSV or a service
+                sector_manager = create_sector_manager()
+                scanned_files = sector_manager.scanned_files
+                sync(sector_manager)
+            except Exception as e:
+                print(f"❌ Sync failed, waiting for the next change: {e!r}")
+    finally:
+        lookup_cache.save()
+        print("🔌 SSH pool stats:", wp_runner.stats())
+        wp_runner.close()
+        tracer.print_summary()
+        tracer.close()
@@ -23,13 +23,29 @@ class SectorTabCreator:
         self.image_creator = image_creator
         self.wp_host = wp_host
 
+    def get_tab_image_name(self, sector, subsector):
+        level_name_key = "sector" if sector["level"] == "L1" else "subsector"
+        return f"{slugify(sector[level_name_key])}-{slugify(subsector)}-tab-image-optimized.jpg"
+
+    def get_tab_image_jobs(self, sector, directory_path):
+        # (source image, optimized image name, width) of every tab image that
+        # create_tab_content will need, for the image optimization pre-pass
+        image_jobs = []
+        if not os.path.isdir(directory_path):
+            return image_jobs
+        for subsector in os.listdir(directory_path):
+            tab_image_path = os.path.join(directory_path, subsector, "tabimage.jpg")
+            if os.path.exists(tab_image_path):
+                image_jobs.append(
+                    (tab_image_path, self.get_tab_image_name(sector, subsector), 800)
+                )
+        return image_jobs
+
     def create_tab_content(self, sector, directory_path):
         subsector_list = []
         level = sector["level"]
         if level not in ["L1", "L2"]:
             raise ValueError(f"Invalid level {level} for sector {sector['sector']}")
-        level_name_key = "sector" if level == "L1" else "subsector"
-        sublevel_name_key = "subsector" if level == "L1" else "category"
         # Walk through each sub-directory of directory_path
         for subsector in os.listdir(directory_path):
             subsector_path = os.path.join(directory_path, subsector)
@@ -43,7 +59,7 @@ class SectorTabCreator:
                 if os.path.exists(tab_image_path):
                     image_id, image_url = self.image_creator.check_and_create_image(
                         tab_image_path,
-                        f"{slugify(sector[level_name_key])}-{slugify(subsector)}-tab-image-optimized.jpg",
+                        self.get_tab_image_name(sector, subsector),
                         width=800,
                     )
                     if not image_id:
@@ -61,16 +77,9 @@ class SectorTabCreator:
                     raise FileNotFoundError(
                         f"Tab image file not found for subsector {subsector} at {tab_image_path}"
                     )
-                # Get the tab link by searching for the subsector in self.sector_data
-                subsector_index = self.sector_data.index(
-                    next(
-                        item
-                        for item in self.sector_data
-                        if item.get(sublevel_name_key) == subsector
-                    )
-                )
-                subsector_data = self.sector_data[subsector_index]
-                if subsector is None:
+                # Get the tab link from the child row of this sector
+                subsector_data = self.sector_data.get_child(sector, subsector)
+                if subsector_data is None:
                     raise ValueError(f"Subsector {subsector} not found in sector data.")
                 subsector_url = (
                     f"https://{self.wp_host}/industries/{subsector_data['slug']}/"
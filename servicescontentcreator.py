@@ -1,4 +1,5 @@
 import os
+import threading
 from slugify import slugify
 
 SERVICES = [
@@ -108,124 +109,204 @@ SERVICES_MAPPING_BY_SECTOR = {
 }
 
 
+SERVICES_BY_ID = {service["id"]: service for service in SERVICES}
+
+
+def get_service_image_name(service_id):
+    return f"service-widget-{slugify(service_id)}-optimized.jpg"
+
+
+def get_service_ids(sector):
+    # The services shown on a sector page. For L3, use the mapping of the
+    # category if it exists, then of the subsector, and default to the
+    # sector. For L2, use the subsector, otherwise the sector. For L1, use
+    # the sector directly.
+    if sector["level"] == "L3":
+        return SERVICES_MAPPING_BY_SECTOR.get(
+            sector["category"],
+            SERVICES_MAPPING_BY_SECTOR.get(
+                sector["subsector"],
+                SERVICES_MAPPING_BY_SECTOR.get(sector["sector"], []),
+            ),
+        )
+    elif sector["level"] == "L2":
+        return SERVICES_MAPPING_BY_SECTOR.get(
+            sector["subsector"],
+            SERVICES_MAPPING_BY_SECTOR.get(sector["sector"], []),
+        )
+    elif sector["level"] == "L1":
+        return SERVICES_MAPPING_BY_SECTOR.get(sector["sector"], [])
+    return []
+
+
+def get_service_image_jobs(services=SERVICES):
+    # (source image, optimized image name, width) of every service image, for
+    # the image optimization pre-pass
+    image_jobs = []
+    for service in services:
+        service_directory = f"redseer-sector-data/services/{service['name']}"
+        image_jobs.append(
+            (
+                f"{service_directory}/image.jpg",
+                get_service_image_name(service["id"]),
+                400,
+            )
+        )
+    return image_jobs
+
+
+def get_services(sectors):
+    # The services shown on any of the sectors' pages
+    service_ids = set()
+    for sector in sectors:
+        service_ids.update(get_service_ids(sector))
+    return [service for service in SERVICES if service["id"] in service_ids]
+
+
 class ServicesContentCreator:
-    def __init__(self, wp_command_runner, image_creator):
+    """
+    Service cards of the sector pages.
+
+    A service is loaded the first time a page shows it: its directory and
+    description are created if missing, the description is read and its
+    image is looked up or uploaded. Runs that show few services, or none
+    with sync_json, do no work for the others. The cards of a list of
+    services are rendered once and the same list is returned to every page
+    that shows those services, so callers must not modify it.
+    """
+
+    def __init__(self, wp_command_runner, image_creator, lookup_cache=None):
         self.services = SERVICES
+        self.services_by_id = SERVICES_BY_ID
         self.wp_runner = wp_command_runner
         self.image_creator = image_creator
-        self.create_content_directories()
-        self.create_and_load_services_content()
+        self.lookup_cache = lookup_cache
+        # IDs of the services loaded in this run
+        self.loaded_services = set()
+        # Service IDs of a page, as a tuple -> its rendered cards
+        self.cards = {}
+        self.lock = threading.Lock()
 
-    def create_content_directories(self):
+    def create_content_directory(self, service):
         base_path = "redseer-sector-data/services"
-        for service in self.services:
-            service_name = service["name"]
-            directory_path = f"{base_path}/{service_name}"
-            # Check if the directory already exists
-            if os.path.exists(directory_path):
-                print(f"Directory already exists: {directory_path}")
-            else:
-                try:
-                    os.makedirs(directory_path, exist_ok=True)
-                    print(f"Created directory: {directory_path}")
-                except Exception as e:
-                    print(f"Error creating directory {directory_path}: {e}")
-            # Create content placeholder file if it doesn't exist
-            content_file_path = f"{directory_path}/description.txt"
-            if not os.path.exists(content_file_path):
-                try:
-                    with open(content_file_path, "w") as content_file:
-                        content_file.write(f"Content for {service_name} service.")
-                    print(f"Created content file: {content_file_path}")
-                except Exception as e:
-                    print(f"Error creating content file {content_file_path}: {e}")
+        service_name = service["name"]
+        directory_path = f"{base_path}/{service_name}"
+        # Check if the directory already exists
+        if os.path.exists(directory_path):
+            print(f"Directory already exists: {directory_path}")
+        else:
+            try:
+                os.makedirs(directory_path, exist_ok=True)
+                print(f"Created directory: {directory_path}")
+            except Exception as e:
+                print(f"Error creating directory {directory_path}: {e}")
+        # Create content placeholder file if it doesn't exist
+        content_file_path = f"{directory_path}/description.txt"
+        if not os.path.exists(content_file_path):
+            try:
+                with open(content_file_path, "w") as content_file:
+                    content_file.write(f"Content for {service_name} service.")
+                print(f"Created content file: {content_file_path}")
+            except Exception as e:
+                print(f"Error creating content file {content_file_path}: {e}")
 
-    def create_and_load_services_content(self):
-        for service in self.services:
-            service_name = service["name"]
-            service_id = service["id"]
-            # Read service content from the description file
-            description_file_path = (
-                f"redseer-sector-data/services/{service_name}/description.txt"
+    def unload_services(self):
+        # Forget the loaded services, e.g. to pick up images uploaded since.
+        # The pages load them again when they show them.
+        with self.lock:
+            self.cards.clear()
+            self.loaded_services.clear()
+
+    def get_service(self, service_id):
+        # Called with the lock held
+        service = self.services_by_id.get(service_id)
+        if service and service_id not in self.loaded_services:
+            self.create_content_directory(service)
+            self.load_service(service)
+            self.loaded_services.add(service_id)
+        return service
+
+    def load_service(self, service):
+        service_name = service["name"]
+        service_id = service["id"]
+        # Read service content from the description file
+        description_file_path = (
+            f"redseer-sector-data/services/{service_name}/description.txt"
+        )
+        if os.path.exists(description_file_path):
+            with open(description_file_path, "r") as file:
+                service["content"] = file.read().strip()
+                print(f"Loaded content for {service_name}.")
+        else:
+            print(f"No description.txt found for {service_name}. Creating new content.")
+            # Create a placeholder content if it doesn't exist
+            service["content"] = f"Placeholder content for {service_name}."
+        self.import_legacy_image_id(service)
+        # Check if the image for the service exists locally
+        image_file_paths = [
+            f"redseer-sector-data/services/{service_name}/image.jpg",
+            f"redseer-sector-data/services/{service_name}/image.png",
+        ]
+        image_file_path = None
+        for path in image_file_paths:
+            if os.path.exists(path):
+                image_file_path = path
+                break
+        optimized_image_name = get_service_image_name(service_id)
+        if not image_file_path:
+            print(f"Image file for {service_name} does not exist locally.")
+            # It may have been uploaded before
+            image_id, image_url = self.image_creator.get_wp_image_id_and_url(
+                optimized_image_name
             )
-            if os.path.exists(description_file_path):
-                with open(description_file_path, "r") as file:
-                    service["content"] = file.read().strip()
-                    print(f"Loaded content for {service_name}.")
-            else:
-                print(
-                    f"No description.txt found for {service_name}. Creating new content."
-                )
-                # Create a placeholder content if it doesn't exist
-                service["content"] = f"Placeholder content for {service_name}."
-            # Check if we have the image ID and URL for the service stored in the service dictionary
-            # Load these to the dictionary if they exist
-            id_url_file = f"redseer-sector-data/services/{service_name}/id_url.txt"
-            if os.path.exists(id_url_file):
-                with open(id_url_file, "r") as file:
-                    lines = file.readlines()
-                    if len(lines) >= 2:
-                        service["image_id"] = lines[0].strip()
-                        service["image_url"] = lines[1].strip()
-                        print(f"Loaded image ID and URL for {service_name}.")
-                        continue
-                    else:
-                        print(f"Invalid id_url.txt format for {service_name}.")
-            print(f"No id_url.txt found for {service_name}. Creating new image.")
-            # Check if the image for the service exists locally
-            image_file_paths = [
-                f"redseer-sector-data/services/{service_name}/image.jpg",
-                f"redseer-sector-data/services/{service_name}/image.png",
-            ]
-            image_file_path = None
-            for path in image_file_paths:
-                if os.path.exists(path):
-                    image_file_path = path
-                    break
-            if not image_file_path:
-                print(f"Image file for {service_name} does not exist locally.")
-                continue
+        else:
             # Check if the image file exists on WordPress
-            optimized_image_name = f"service-widget-{slugify(service_id)}-optimized.jpg"
             image_id, image_url = self.image_creator.check_and_create_image(
                 image_file_path, optimized_image_name, width=400
             )
-            if image_id is None or image_url is None:
-                print(f"Failed to create or find image for {service_name}.")
-                continue
-            # Store the image ID and URL in the service dictionary
-            with open(id_url_file, "w") as file:
-                file.write(f"{image_id}\n{image_url}\n")
-            service["image_id"] = image_id
-            service["image_url"] = image_url
-            print(
-                f"Image for {service_name} created with ID {image_id} and URL {image_url}."
+        if image_id is None or image_url is None:
+            print(f"Failed to create or find image for {service_name}.")
+            return
+        # Store the image ID and URL in the service dictionary
+        service["image_id"] = image_id
+        service["image_url"] = image_url
+        print(
+            f"Image for {service_name} created with ID {image_id} and URL {image_url}."
+        )
+
+    def import_legacy_image_id(self, service):
+        # The image ID and URL of a service used to be kept in an id_url.txt
+        # in its directory. Hand them to the media index, which keeps them in
+        # the lookup cache from now on.
+        id_url_file = f"redseer-sector-data/services/{service['name']}/id_url.txt"
+        optimized_image_name = get_service_image_name(service["id"])
+        if not os.path.exists(id_url_file) or (
+            self.lookup_cache is not None
+            and self.lookup_cache.get("media", optimized_image_name) is not None
+        ):
+            return
+        with open(id_url_file, "r") as file:
+            lines = file.readlines()
+        if len(lines) >= 2:
+            self.image_creator.media_index.add(
+                lines[0].strip(), lines[1].strip(), optimized_image_name
             )
+            print(f"📦 Imported the image ID of {service['name']} from id_url.txt.")
+        else:
+            print(f"Invalid id_url.txt format for {service['name']}.")
 
     def create_services_content(self, sector):
-        # Check the level of the sector
-        # For L3, check if sector["category"] exists. If not,
-        # check if sector["subsector"] exists. Default to sector["sector"] if neither exists.
-        # For L2, use sector["subsector"] if it exists, otherwise use sector["sector"].
-        # For L1, use sector["sector"] directly.
-        if sector["level"] == "L3":
-            services = SERVICES_MAPPING_BY_SECTOR.get(
-                sector["category"],
-                SERVICES_MAPPING_BY_SECTOR.get(
-                    sector["subsector"],
-                    SERVICES_MAPPING_BY_SECTOR.get(sector["sector"], []),
-                ),
-            )
-        elif sector["level"] == "L2":
-            services = SERVICES_MAPPING_BY_SECTOR.get(
-                sector["subsector"],
-                SERVICES_MAPPING_BY_SECTOR.get(sector["sector"], []),
-            )
-        elif sector["level"] == "L1":
-            services = SERVICES_MAPPING_BY_SECTOR.get(sector["sector"], [])
+        services = tuple(get_service_ids(sector))
+        with self.lock:
+            if services not in self.cards:
+                self.cards[services] = self.render_services_content(services)
+            return self.cards[services]
+
+    def render_services_content(self, services):
+        # Called with the lock held
         services_content = []
         for service in services:
-            service_data = next((s for s in self.services if s["id"] == service), None)
+            service_data = self.get_service(service)
             if service_data:
                 # Sample content structure
                 # {
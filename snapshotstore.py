@@ -0,0 +1,110 @@
+import json
+import os
+from datetime import datetime
+from expertsectioncreator import USER_FIELDS, get_user_list_command
+from fakewprunner import FakeWPCommandRunner
+from mediaindex import MediaIndex
+from pageindex import PageIndex
+from templatecache import TEMPLATE_SLUGS
+
+SNAPSHOT_DIRECTORY = "redseer-sector-snapshots"
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """
+    Local copy of everything rendering the sector pages reads from a
+    WordPress host: the pages (with the Elementor data of the three level
+    templates), the users that can be experts and the media index of the
+    optimized images.
+
+    pull() saves it to redseer-sector-snapshots/<host>.json, and
+    create_runner() returns a FakeWPCommandRunner with the same pages,
+    users and attachments, under their real IDs. Pages rendered against it
+    are the pages a sync would write, without a connection to the host.
+    """
+
+    def __init__(self, host, directory=SNAPSHOT_DIRECTORY):
+        self.host = host
+        self.path = os.path.join(directory, f"{host}.json")
+
+    def pull(self, wp_runner, expert_roles=None):
+        print(f"📀 Pulling a snapshot of {self.host}...")
+        page_index = PageIndex(wp_runner)
+        page_index.load()
+        templates = {}
+        for slug in TEMPLATE_SLUGS:
+            page_id = page_index.get_page_id(slug)
+            if not page_id:
+                raise ValueError(f"Template page {slug} not found.")
+            templates[str(page_id)] = wp_runner.run_wp_cli(
+                f"wp post meta get {page_id} _elementor_data"
+            )
+        users = json.loads(
+            wp_runner.run_wp_cli(
+                get_user_list_command(expert_roles, f"{USER_FIELDS},roles")
+            )
+            or "[]"
+        )
+        media_index = MediaIndex(wp_runner)
+        media_index.load()
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "host": self.host,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "pages": sorted(page_index.pages_by_id.values(), key=lambda p: p["ID"]),
+            "templates": templates,
+            "users": users,
+            "media": media_index.attachments,
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(snapshot, f, indent=4, sort_keys=True)
+        os.replace(temp_path, self.path)
+        print(
+            f"💾 Snapshot saved to {self.path}: {len(snapshot['pages'])} pages, "
+            f"{len(users)} users, {len(snapshot['media'])} images."
+        )
+        return snapshot
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise ValueError(
+                f"No snapshot of {self.host}, pull one with --snapshot-pull first."
+            )
+        with open(self.path, "r") as f:
+            snapshot = json.load(f)
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"Unsupported snapshot version {snapshot.get('version')} in {self.path}"
+            )
+        return snapshot
+
+    def create_runner(self):
+        """A fake WordPress with the content of the snapshot."""
+        snapshot = self.load()
+        print(f"📀 Using the snapshot of {self.host} from {snapshot['created']}.")
+        wp_runner = FakeWPCommandRunner()
+        for page in snapshot["pages"]:
+            template = snapshot["templates"].get(str(page["ID"]))
+            wp_runner.add_post(
+                page["post_name"],
+                parent=page["post_parent"],
+                meta={"_elementor_data": template} if template else None,
+                post_id=int(page["ID"]),
+                modified=page["post_modified"],
+            )
+        for user in snapshot["users"]:
+            wp_runner.add_user(
+                user["user_login"],
+                user["display_name"],
+                user["user_email"],
+                role=user.get("roles") or "author",
+                user_id=int(user["ID"]),
+            )
+        for image_id, image_url in snapshot["media"].values():
+            wp_runner.add_attachment(image_url, post_id=int(image_id))
+        return wp_runner
@@ -0,0 +1,216 @@
+import select
+import threading
+from contextlib import contextmanager
+from fabric import Connection
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result
+
+
+class SSHConnectionPool:
+    """
+    A pool of authenticated SSH connections to one host.
+
+    Commands do not get a connection of their own. Each command leases a
+    channel on one of the pooled transports, so many concurrent callers share
+    a few TCP/SSH handshakes. Up to `size` connections are opened, each
+    carrying at most `max_channels` channels at a time (keep this below the
+    server's MaxSessions, which defaults to 10). File uploads reuse a single
+    SFTP client instead of starting a new SFTP session for every file.
+    """
+
+    def __init__(self, host, user, port=22, size=1, max_channels=8, keepalive=30):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.size = max(1, size)
+        self.max_channels = max_channels
+        self.keepalive = keepalive
+        self.connections = []
+        # Index of the connection -> number of channels leased on it
+        self.channels_in_use = []
+        self.condition = threading.Condition()
+        self.connect_lock = threading.Lock()
+        self.sftp = None
+        self.sftp_lock = threading.Lock()
+        self.counters = {
+            "leases": 0,
+            "waits": 0,
+            "reconnects": 0,
+            "channels_opened": 0,
+            "sftp_sessions": 0,
+            "uploads": 0,
+        }
+
+    def new_connection(self):
+        return Connection(host=self.host, user=self.user, port=self.port)
+
+    @property
+    def connection(self):
+        """The first connection of the pool, created if needed."""
+        with self.condition:
+            if not self.connections:
+                self.connections.append(self.new_connection())
+                self.channels_in_use.append(0)
+            return self.connections[0]
+
+    def count(self, counter, value=1):
+        with self.condition:
+            self.counters[counter] += value
+
+    def get_transport(self, connection):
+        # Open the connection on first use and reconnect if the transport has
+        # gone away since the last lease (server restart, idle timeout).
+        with self.connect_lock:
+            transport = connection.client.get_transport()
+            if transport is None or not transport.is_active():
+                if transport is not None:
+                    self.count("reconnects")
+                    connection.close()
+                connection.open()
+                transport = connection.client.get_transport()
+                transport.set_keepalive(self.keepalive)
+            return transport
+
+    def acquire(self):
+        with self.condition:
+            self.counters["leases"] += 1
+            waited = False
+            while True:
+                # Pick the least busy connection that has a free channel
+                candidates = [
+                    index
+                    for index, in_use in enumerate(self.channels_in_use)
+                    if in_use < self.max_channels
+                ]
+                if candidates:
+                    index = min(candidates, key=lambda i: self.channels_in_use[i])
+                    # Prefer opening another connection over stacking
+                    # channels while the pool is not full.
+                    if (
+                        self.channels_in_use[index] == 0
+                        or len(self.connections) >= self.size
+                    ):
+                        break
+                if len(self.connections) < self.size:
+                    self.connections.append(self.new_connection())
+                    self.channels_in_use.append(0)
+                    index = len(self.connections) - 1
+                    break
+                if not waited:
+                    self.counters["waits"] += 1
+                    waited = True
+                self.condition.wait()
+            self.channels_in_use[index] += 1
+            return index
+
+    def release(self, index):
+        with self.condition:
+            self.channels_in_use[index] -= 1
+            self.condition.notify()
+
+    def open_channel(self):
+        """
+        Open a session channel on a pooled connection. The channel counts
+        against the pool until it is handed back with close_channel().
+        """
+        index = self.acquire()
+        try:
+            transport = self.get_transport(self.connections[index])
+            channel = transport.open_session()
+        except Exception:
+            self.release(index)
+            raise
+        self.count("channels_opened")
+        channel.pool_index = index
+        return channel
+
+    def close_channel(self, channel):
+        try:
+            channel.close()
+        finally:
+            self.release(channel.pool_index)
+
+    @contextmanager
+    def channel(self):
+        channel = self.open_channel()
+        try:
+            yield channel
+        finally:
+            self.close_channel(channel)
+
+    def run(self, command, stdin=None, timeout=None, warn=False):
+        """
+        Run a command on a leased channel. Raises UnexpectedExit like fabric's
+        Connection.run() when the command fails, unless warn is set.
+        """
+        stdout = []
+        stderr = []
+        with self.channel() as channel:
+            channel.settimeout(timeout)
+            channel.exec_command(command)
+            if stdin is not None:
+                if isinstance(stdin, str):
+                    stdin = stdin.encode("utf-8")
+                channel.sendall(stdin)
+            channel.shutdown_write()
+            # Read stdout and stderr as they arrive so that neither can fill
+            # the channel window and stall the remote command.
+            while True:
+                if channel.recv_ready():
+                    stdout.append(channel.recv(65536))
+                elif channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(65536))
+                elif channel.exit_status_ready():
+                    break
+                else:
+                    select.select([channel], [], [], timeout)
+            # Drain anything that arrived with the exit status
+            while channel.recv_ready():
+                stdout.append(channel.recv(65536))
+            while channel.recv_stderr_ready():
+                stderr.append(channel.recv_stderr(65536))
+            exited = channel.recv_exit_status()
+        result = Result(
+            stdout=b"".join(stdout).decode("utf-8", errors="replace"),
+            stderr=b"".join(stderr).decode("utf-8", errors="replace"),
+            command=command,
+            exited=exited,
+            hide=("stdout", "stderr"),
+        )
+        if exited != 0 and not warn:
+            raise UnexpectedExit(result)
+        return result
+
+    def get_sftp(self):
+        # Called with sftp_lock held
+        if self.sftp is None or self.sftp.get_channel().closed:
+            transport = self.get_transport(self.connection)
+            self.sftp = transport.open_sftp_client()
+            self.count("sftp_sessions")
+        return self.sftp
+
+    def put(self, local, remote_path):
+        """Upload a local path or file-like object over the shared SFTP client."""
+        with self.sftp_lock:
+            sftp = self.get_sftp()
+            if hasattr(local, "read"):
+                sftp.putfo(local, remote_path)
+            else:
+                sftp.put(local, remote_path)
+        self.count("uploads")
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self.counters)
+            stats["connections"] = len(self.connections)
+            stats["in_use"] = sum(self.channels_in_use)
+        return stats
+
+    def close(self):
+        with self.sftp_lock:
+            if self.sftp is not None:
+                self.sftp.close()
+                self.sftp = None
+        with self.condition:
+            for connection in self.connections:
+                connection.close()
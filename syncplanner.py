@@ -0,0 +1,270 @@
+import json
+from datetime import datetime
+from instrumentation import tracer
+from pagemanifest import fetch_remote_hashes, hash_value, payload_md5
+from servicescontentcreator import get_service_ids, get_service_image_name
+
+PLAN_VERSION = 2
+
+
+def save_plan(plan, path):
+    with open(path, "w") as f:
+        json.dump(plan, f, indent=4)
+
+
+def load_plan(path):
+    with open(path, "r") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {plan.get('version')} in {path}")
+    return plan
+
+
+class SyncPlanner:
+    """
+    Work out what a sync will change before changing anything.
+
+    build_plan() fetches the remote state in bulk (pages, media library,
+    users and the MD5 of the current _elementor_data of every page), renders
+    every page locally and returns the images to upload, the pages to create
+    and the pages whose content differs from the server. apply_plan() then
+    makes exactly those changes.
+
+    The SectorManager must be created with upload_images=False, so that
+    images are only looked up while the plan is built.
+    """
+
+    def __init__(self, sector_manager):
+        self.sector_manager = sector_manager
+
+    def get_template_states(self, page_ids_by_level):
+        # The pages of a plan are rendered from the templates as they are now
+        manager = self.sector_manager
+        return {
+            level: {
+                "post_modified": manager.template_cache.get_modified(page_id),
+                "sha256": hash_value(
+                    manager.template_cache.get_elementor_data(page_id)
+                ),
+            }
+            for level, page_id in page_ids_by_level.items()
+        }
+
+    def get_page_image_names(self, sector):
+        # Optimized names of every image that ends up in the page's content
+        manager = self.sector_manager
+        names = {
+            update["image-file-name"] for update in manager.get_image_updates(sector)
+        }
+        if sector.level in ["L1", "L2"]:
+            names.update(
+                name
+                for _, name, _ in manager.sector_tab_creator.get_tab_image_jobs(
+                    sector, sector.get_data_directory()
+                )
+            )
+        names.update(
+            get_service_image_name(service_id) for service_id in get_service_ids(sector)
+        )
+        return names
+
+    def build_plan(self):
+        manager = self.sector_manager
+        if manager.sync_json:
+            raise ValueError("A plan can not be made in sync JSON mode.")
+        if not manager.image_creator.lookup_only:
+            raise ValueError("Create the SectorManager with upload_images=False.")
+        with tracer.span("phase.plan"):
+            print("📀 Loading remote state...")
+            manager.page_index.load()
+            manager.image_creator.media_index.load()
+            page_ids_by_level, parent_page_id = (
+                manager.get_template_and_parent_page_ids()
+            )
+            sectors = manager.get_sectors_to_sync()
+            post_ids = {
+                sector.slug: manager.get_page_id_by_slug(sector.slug)
+                for sector in sectors
+            }
+            remote_hashes = fetch_remote_hashes(
+                manager.wp_runner, [post_id for post_id in post_ids.values() if post_id]
+            )
+            image_jobs = manager.get_image_jobs()
+            # The images are optimized when the plan is applied
+            missing_images = manager.image_creator.find_missing_images(
+                image_jobs, optimized=False
+            )
+            plan = {
+                "version": PLAN_VERSION,
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "host": manager.wp_host,
+                "levels": manager.levels,
+                "template_page_ids": page_ids_by_level,
+                "templates": self.get_template_states(page_ids_by_level),
+                "parent_page_id": parent_page_id,
+                "uploads": [],
+                "creates": [],
+                "updates": [],
+                "unchanged": [],
+            }
+            planned_images = set()
+            for image_file_path, optimized_image_name, width in image_jobs:
+                if (
+                    optimized_image_name in missing_images
+                    and optimized_image_name not in planned_images
+                ):
+                    planned_images.add(optimized_image_name)
+                    plan["uploads"].append(
+                        {
+                            "source": image_file_path,
+                            "name": optimized_image_name,
+                            "width": width,
+                        }
+                    )
+            print(f"🛠️ Rendering {len(sectors)} pages...")
+            for sector in sectors:
+                post_id = post_ids[sector.slug]
+                if not post_id:
+                    plan["creates"].append(
+                        {
+                            "slug": sector.slug,
+                            "title": sector.name,
+                            "level": sector.level,
+                            "parent_page_id": parent_page_id,
+                            "template_page_id": page_ids_by_level[sector.level],
+                        }
+                    )
+                # Images that are not uploaded yet are left out of the
+                # rendered page, so its final content is known only then
+                pending_images = sorted(
+                    self.get_page_image_names(sector) & planned_images
+                )
+                elementor_data, _ = manager.render_page(
+                    page_ids_by_level[sector.level],
+                    sector.get_data_directory(),
+                    sector,
+                )
+                md5 = payload_md5(json.dumps(elementor_data))
+                remote_md5 = remote_hashes.get(str(post_id)) if post_id else None
+                if not post_id:
+                    reason = "new page"
+                elif pending_images:
+                    reason = "images pending"
+                elif remote_md5 != md5:
+                    reason = "content changed"
+                else:
+                    plan["unchanged"].append(sector.slug)
+                    continue
+                plan["updates"].append(
+                    {
+                        "slug": sector.slug,
+                        "post_id": post_id,
+                        "reason": reason,
+                        "payload_md5": None if pending_images else md5,
+                        "remote_md5": remote_md5,
+                        "pending_images": pending_images,
+                    }
+                )
+            manager.image_creator.image_cache.save()
+            manager.lookup_cache.save()
+        return plan
+
+    def print_plan(self, plan):
+        print(
+            f"📋 Plan for {plan['host']}: {len(plan['uploads'])} uploads, "
+            f"{len(plan['creates'])} creates, {len(plan['updates'])} updates, "
+            f"{len(plan['unchanged'])} unchanged pages"
+        )
+        for upload in plan["uploads"]:
+            print(f"   🖼️ upload {upload['name']} from {upload['source']}")
+        for create in plan["creates"]:
+            print(f"   ✨ create {create['level']} page '{create['slug']}'")
+        for update in plan["updates"]:
+            post_id = update["post_id"] or "new"
+            print(f"   🔄 update '{update['slug']}' ({post_id}): {update['reason']}")
+
+    def apply_plan(self, plan):
+        """
+        Make the changes of a plan: upload its images in one batch, then
+        create and update its pages, in parallel with the manager's jobs.
+        Pages that are not in the plan are not touched.
+        """
+        manager = self.sector_manager
+        if plan["host"] != manager.wp_host:
+            raise ValueError(
+                f"The plan is for {plan['host']}, not for {manager.wp_host}."
+            )
+        manager.page_index.load()
+        page_ids_by_level, parent_page_id = manager.get_template_and_parent_page_ids()
+        if (
+            page_ids_by_level != plan["template_page_ids"]
+            or parent_page_id != plan["parent_page_id"]
+        ):
+            raise ValueError("The template pages changed since the plan was made.")
+        # The MD5s of the plan were rendered from the templates it recorded
+        templates = self.get_template_states(page_ids_by_level)
+        changed_levels = sorted(
+            level
+            for level, template in templates.items()
+            if plan["templates"].get(level) != template
+        )
+        if changed_levels:
+            raise ValueError(
+                f"The templates of {', '.join(changed_levels)} were edited since "
+                "the plan was made, make a new plan."
+            )
+        image_creator = manager.image_creator
+        if plan["uploads"]:
+            image_jobs = [
+                (upload["source"], upload["name"], upload["width"])
+                for upload in plan["uploads"]
+            ]
+            image_creator.optimize_images(image_jobs)
+            image_creator.upload_missing_images(image_jobs)
+            # Pick up the IDs of service images uploaded just now
+            manager.services_content_creator.unload_services()
+            image_creator.image_cache.save()
+        # A page is written unless it already has the content the plan saw
+        # on the server
+        manager.verify_remote = True
+        manager.remote_hashes = {
+            str(update["post_id"]): update["remote_md5"]
+            for update in plan["updates"]
+            if update["post_id"] and update["remote_md5"]
+        }
+        # Pages are only written with the content the plan rendered, except
+        # the pages with pending images, whose content was not known then
+        manager.planned_hashes = {
+            update["slug"]: update["payload_md5"]
+            for update in plan["updates"]
+            if update["payload_md5"]
+        }
+        slugs = {update["slug"] for update in plan["updates"]}
+        slugs.update(create["slug"] for create in plan["creates"])
+        sectors = [
+            sector for sector in manager.get_sectors_to_sync() if sector.slug in slugs
+        ]
+        if not sectors:
+            print("✅ Nothing to do.")
+            return
+        print(f"🛠️ Applying plan to {len(sectors)} pages...")
+        try:
+            with tracer.span("phase.pages", pages=len(sectors)):
+                if manager.jobs > 1:
+                    manager.sync_sectors_in_parallel(
+                        sectors, page_ids_by_level, parent_page_id
+                    )
+                else:
+                    for sector in sectors:
+                        manager.sync_sector(sector, page_ids_by_level, parent_page_id)
+        finally:
+            # Also after a failure, see SectorManager.create_sector_pages
+            with tracer.span("phase.invalidate"):
+                manager.invalidate_caches()
+        manager.lookup_cache.save()
+        if manager.failed_slugs:
+            raise ValueError(
+                f"{len(manager.failed_slugs)} pages were not applied: "
+                f"{', '.join(sorted(manager.failed_slugs))}. The content may "
+                "have changed since the plan was made, make a new plan."
+            )
@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import time
+from pagemanifest import MANIFEST_FILE_NAME
+from servicescontentcreator import SERVICES, get_service_ids
+
+DATA_DIRECTORY = "redseer-sector-data"
+SYNC_STATE_FILE = "redseer-sector-data/sync-state.json"
+# Files the scripts write themselves, changes to them are not edits
+GENERATED_FILE_NAMES = {
+    "elementor_data.json",
+    MANIFEST_FILE_NAME,
+    "id_url.txt",
+    "image-cache.json",
+    "image-cache.json.tmp",
+    "lookup-cache.json",
+    "lookup-cache.json.tmp",
+    "sync-state.json",
+    "sync-state.json.tmp",
+}
+# Files of a child page that are shown in the tab list of its parent, see
+# SectorTabCreator.create_tab_content
+TAB_FILE_NAMES = ["tab-description.txt", "tabimage.jpg"]
+SERVICE_FILE_NAMES = ["description.txt", "image.jpg", "image.png"]
+
+
+def is_generated(file_name):
+    return file_name in GENERATED_FILE_NAMES or file_name.endswith("-optimized.jpg")
+
+
+def scan_files(sector_file, known_files, data_directory=DATA_DIRECTORY):
+    """
+    Record every content file with its size, mtime and sha256. Files of
+    known_files whose size and mtime did not change are not read again.
+    """
+    paths = [sector_file]
+    for directory, _, file_names in os.walk(data_directory):
+        paths.extend(
+            os.path.join(directory, file_name)
+            for file_name in file_names
+            if not is_generated(file_name)
+        )
+    files = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        known = known_files.get(path)
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            files[path] = known
+            continue
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        files[path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": digest.hexdigest(),
+        }
+    return files
+
+
+def get_changed_files(previous_files, files):
+    """Files added, removed or edited between two scans."""
+    return sorted(
+        path
+        for path in set(previous_files) | set(files)
+        if previous_files.get(path, {}).get("sha256")
+        != files.get(path, {}).get("sha256")
+    )
+
+
+class SyncState:
+    """
+    What the content looked like at the end of the last successful sync to
+    a host.
+
+    Every file under redseer-sector-data/ and the sector CSV is recorded
+    with its size, mtime and sha256, and every template page with its
+    post_modified. A file whose size and mtime did not change is not read
+    again. Comparing a new scan with the state gives the edited files.
+    Pages that failed are recorded by slug and synced again by the next run.
+
+    The state is kept per host, so a sync to one host does not make the
+    content look unchanged to another.
+    """
+
+    def __init__(self, host, path=SYNC_STATE_FILE):
+        self.host = host
+        self.path = path
+        # host -> {"files", "templates", "failed"}
+        self.hosts = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    # A state without a host is not trusted for any host
+                    self.hosts = json.load(f).get("hosts", {})
+            except ValueError:
+                print(f"❌ Invalid sync state {path}, syncing everything.")
+        state = self.hosts.get(host, {})
+        # file path -> {"size", "mtime", "sha256"}
+        self.files = state.get("files", {})
+        # level -> post_modified of its template page
+        self.templates = state.get("templates", {})
+        # Slugs of the pages that failed
+        self.failed_slugs = set(state.get("failed", []))
+
+    def scan(self, sector_file, data_directory=DATA_DIRECTORY):
+        return scan_files(sector_file, self.files, data_directory)
+
+    def changed_files(self, files):
+        """Files added, removed or edited since the state was saved."""
+        return get_changed_files(self.files, files)
+
+    def changed_templates(self, templates):
+        return sorted(
+            level
+            for level, modified in templates.items()
+            if self.templates.get(level) != modified
+        )
+
+    def save(self, files, templates, failed_slugs=()):
+        self.files = files
+        self.templates = templates
+        self.failed_slugs = set(failed_slugs)
+        self.hosts[self.host] = {
+            "files": files,
+            "templates": templates,
+            "failed": sorted(self.failed_slugs),
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"hosts": self.hosts}, f, indent=4, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+
+def build_dependency_graph(sectors, data_directory=DATA_DIRECTORY):
+    """
+    Map every content file to the slugs of the pages it is rendered into.
+    A page depends on the files in its own directory, the tab files of its
+    child pages (L1 and L2) and the files of the services it shows.
+    Returns (file path -> set of slugs, page directory -> slug).
+    """
+    graph = {}
+    slugs_by_directory = {}
+    service_names = {service["id"]: service["name"] for service in SERVICES}
+    for sector in sectors:
+        directory = os.path.normpath(sector.get_data_directory())
+        slugs_by_directory[directory] = sector.slug
+        if os.path.isdir(directory):
+            for entry in os.listdir(directory):
+                path = os.path.join(directory, entry)
+                if os.path.isdir(path):
+                    if sector.level in ["L1", "L2"]:
+                        for file_name in TAB_FILE_NAMES:
+                            graph.setdefault(os.path.join(path, file_name), set()).add(
+                                sector.slug
+                            )
+                elif not is_generated(entry):
+                    graph.setdefault(path, set()).add(sector.slug)
+        for service_id in get_service_ids(sector):
+            if service_id not in service_names:
+                continue
+            for file_name in SERVICE_FILE_NAMES:
+                path = os.path.join(
+                    data_directory, "services", service_names[service_id], file_name
+                )
+                graph.setdefault(path, set()).add(sector.slug)
+    return graph, slugs_by_directory
+
+
+def get_affected_slugs(sectors, changed_files, sector_file):
+    """Slugs of the pages that have to be rendered again for changed_files."""
+    if sector_file in changed_files:
+        # Rows, experts or the hierarchy may have changed
+        return {sector.slug for sector in sectors}
+    graph, slugs_by_directory = build_dependency_graph(sectors)
+    affected = set()
+    for path in changed_files:
+        path = os.path.normpath(path)
+        if path in graph:
+            affected.update(graph[path])
+        elif os.path.dirname(path) in slugs_by_directory:
+            # A file that is new or was removed from a page's directory
+            affected.add(slugs_by_directory[os.path.dirname(path)])
+        if os.path.basename(path) in TAB_FILE_NAMES:
+            # A new child directory is not in the graph yet
+            parent_directory = os.path.dirname(os.path.dirname(path))
+            if parent_directory in slugs_by_directory:
+                affected.add(slugs_by_directory[parent_directory])
+    return affected
+
+
+def wait_for_changes(sector_file, files, interval=2.0):
+    """
+    Poll the content until a file is added, removed or edited compared to
+    files, a scan taken before the last sync read the content, so edits
+    saved during the sync are found too. Returns the changed paths.
+    """
+    while True:
+        time.sleep(interval)
+        changed = get_changed_files(files, scan_files(sector_file, files))
+        if changed:
+            return changed
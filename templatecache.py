@@ -0,0 +1,69 @@
+import copy
+import json
+import threading
+from instrumentation import tracer
+
+# Slugs of the template pages of L1, L2 and L3
+TEMPLATE_SLUGS = ["sector-level-1", "sector-level-2", "sector-level-3"]
+
+
+class TemplateCache:
+    """
+    Cache of the Elementor data of the sector template pages.
+
+    Each template is fetched from WordPress once and stored under its page ID
+    and post_modified time. Every caller gets its own deep copy, so updating
+    one page never leaks into the next. If the server reports a newer
+    post_modified for a template, the cached copy is dropped and fetched again.
+
+    post_modified is asked from the server once per TemplateCache, not taken
+    from the page index, which may come from the lookup cache and would not
+    show a template edited since.
+    """
+
+    def __init__(self, wp_runner):
+        self.wp_runner = wp_runner
+        # template_page_id -> (post_modified, elementor_data)
+        self.templates = {}
+        # template_page_id -> post_modified on the server
+        self.modified = {}
+        self.lock = threading.Lock()
+
+    def load_modified(self, template_page_ids):
+        """Get the post_modified of many templates in one query."""
+        template_page_ids = sorted({int(page_id) for page_id in template_page_ids})
+        id_list = ",".join(str(page_id) for page_id in template_page_ids)
+        rows = self.wp_runner.run_sql_rows(
+            f"select ID, post_modified from wppj_posts where ID in ({id_list});"
+        )
+        modified = {}
+        for row in rows:
+            if len(row) == 2:
+                modified[int(row[0])] = row[1]
+        with self.lock:
+            for page_id in template_page_ids:
+                self.modified[page_id] = modified.get(page_id)
+
+    def get_modified(self, template_page_id):
+        with self.lock:
+            known = int(template_page_id) in self.modified
+        if not known:
+            self.load_modified([template_page_id])
+        with self.lock:
+            return self.modified.get(int(template_page_id))
+
+    def get_elementor_data(self, template_page_id):
+        """Get a private copy of the template's Elementor data."""
+        modified = self.get_modified(template_page_id)
+        with self.lock:
+            cached = self.templates.get(template_page_id)
+            hit = cached is not None and cached[0] == modified
+            tracer.cache("template", hit)
+            if not hit:
+                print(f"📀 Loading Elementor data for template page {template_page_id}")
+                elementor_data = self.wp_runner.run_wp_cli(
+                    f"wp post meta get {template_page_id} _elementor_data"
+                )
+                cached = (modified, json.loads(elementor_data))
+                self.templates[template_page_id] = cached
+        return copy.deepcopy(cached[1])
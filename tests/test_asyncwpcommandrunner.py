@@ -0,0 +1,268 @@
+"""
+Tests of AsyncWPCommandRunner against an in-process asyncssh server.
+
+The server runs every command it receives on a FakeWPCommandRunner, and
+files uploaded over SFTP land in a temporary directory that the fake's
+`wp media import` reads from, so the whole async sync runs over a real
+SSH connection without a WordPress:
+
+    python -m unittest discover -s tests
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIRECTORY)
+sys.path.insert(0, os.path.join(REPO_DIRECTORY, "benchmarks"))
+
+from invoke.exceptions import UnexpectedExit  # noqa: E402
+from slugify import slugify  # noqa: E402
+from asyncwpcommandrunner import (  # noqa: E402
+    AsyncWPCommandRunner,
+    BlockingWPCommandRunner,
+    asyncssh,
+)
+from fakewprunner import FakeWPCommandRunner  # noqa: E402
+from sectorpagecreator import SectorManager  # noqa: E402
+from syntheticsectordata import generate_sector_data  # noqa: E402
+
+# Used instead of ImageMagick, see benchmarks/sectorsyncbenchmark.py
+COPY_CONVERT_SCRIPT = (
+    '#!/bin/sh\n# convert <source> -resize <w>x -quality <q> <target>\ncp "$1" "$6"\n'
+)
+
+
+class WordPressSSHServer(asyncssh.SSHServer if asyncssh else object):
+    def begin_auth(self, username):
+        # No authentication
+        return False
+
+
+class FakeWordPressHost:
+    """An asyncssh server on localhost in front of a FakeWPCommandRunner."""
+
+    def __init__(self, wp_runner, latency=0.0):
+        self.wp_runner = wp_runner
+        self.latency = latency
+        # SFTP uploads are written under this directory
+        self.root = tempfile.mkdtemp(prefix="fake-wordpress-host-")
+        self.commands = []
+        self.running = 0
+        self.max_running = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncssh.create_server(
+            WordPressSSHServer,
+            "127.0.0.1",
+            0,
+            server_host_keys=[asyncssh.generate_private_key("ssh-ed25519")],
+            process_factory=self.handle_process,
+            sftp_factory=lambda channel: asyncssh.SFTPServer(channel, chroot=self.root),
+            encoding=None,
+        )
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def load_uploads(self):
+        # Hand the files uploaded over SFTP to the fake, by remote path
+        for directory, _, file_names in os.walk(self.root):
+            for file_name in file_names:
+                path = os.path.join(directory, file_name)
+                remote_path = "/" + os.path.relpath(path, self.root)
+                with open(path, "rb") as f:
+                    self.wp_runner.files[remote_path] = f.read()
+
+    async def handle_process(self, process):
+        command = process.command
+        self.commands.append(command)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            stdin = await process.stdin.read()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            self.load_uploads()
+            try:
+                stdout = await asyncio.to_thread(
+                    self.wp_runner.run_command, command, stdin or None
+                )
+                stderr, exit_status = "", 0
+            except UnexpectedExit as e:
+                stdout, stderr = e.result.stdout, e.result.stderr
+                exit_status = e.result.exited
+            if command.startswith("mktemp") and exit_status == 0:
+                os.makedirs(self.root + stdout, exist_ok=True)
+            process.stdout.write(stdout.encode("utf-8"))
+            process.stderr.write(stderr.encode("utf-8"))
+            process.exit(exit_status)
+        finally:
+            self.running -= 1
+
+
+@unittest.skipIf(asyncssh is None, "asyncssh is not installed")
+class AsyncWPCommandRunnerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.wp_runner = FakeWPCommandRunner()
+        self.wp_runner.add_sector_templates()
+        self.host = FakeWordPressHost(self.wp_runner)
+        port = await self.host.start()
+        self.runner = AsyncWPCommandRunner(
+            "127.0.0.1",
+            "ubuntu",
+            port,
+            max_concurrency=4,
+            connect_kwargs={"known_hosts": None, "client_keys": None},
+        )
+        await self.runner.connect()
+
+    async def asyncTearDown(self):
+        await self.runner.close()
+        await self.host.stop()
+
+    async def test_run_wp_cli_runs_in_the_wordpress_directory(self):
+        output = await self.runner.run_wp_cli(
+            "wp post list --post_type=page --format=json --fields=ID,post_name"
+        )
+        self.assertIn(
+            "sector-level-1", [page["post_name"] for page in json.loads(output)]
+        )
+        self.assertTrue(
+            self.host.commands[-1].startswith("cd /home/ubuntu/wordpress && wp ")
+        )
+
+    async def test_stdin_is_passed_to_the_command(self):
+        await self.runner.run_wp_cli(
+            "wp post meta update 4 _elementor_data", stdin=b'[{"id": "1"}]'
+        )
+        output = await self.runner.run_wp_cli("wp post meta get 4 _elementor_data")
+        self.assertEqual(output, '[{"id": "1"}]')
+
+    async def test_failed_command_raises_unexpected_exit(self):
+        with self.assertRaises(UnexpectedExit) as raised:
+            await self.runner.run_wp_cli(
+                "wp post meta update 999 _elementor_data", stdin=b"[]"
+            )
+        self.assertEqual(raised.exception.result.exited, 1)
+        self.assertIn("999", raised.exception.result.stderr)
+
+    async def test_put_uploads_over_sftp(self):
+        remote_directory = await self.runner.run_command("mktemp -d")
+        await self.runner.put(io.BytesIO(b"image"), f"{remote_directory}/a.jpg")
+        with open(f"{self.host.root}{remote_directory}/a.jpg", "rb") as f:
+            self.assertEqual(f.read(), b"image")
+        self.assertEqual(self.runner.stats()["uploads"], 1)
+
+    async def test_blocking_runner_refuses_calls_on_its_loop(self):
+        wp_runner = BlockingWPCommandRunner(self.runner, asyncio.get_running_loop())
+        with self.assertRaises(RuntimeError):
+            wp_runner.run_wp_cli("wp user list --format=json")
+        self.assertEqual(
+            await asyncio.to_thread(wp_runner.run_wp_cli, "wp user list --format=json"),
+            "[]",
+        )
+
+    async def test_commands_run_concurrently_up_to_max_concurrency(self):
+        self.host.latency = 0.05
+        await asyncio.gather(
+            *(self.runner.run_wp_cli("wp user list --format=json") for _ in range(12))
+        )
+        self.assertGreater(self.host.max_running, 1)
+        self.assertLessEqual(self.host.max_running, 4)
+
+
+@unittest.skipIf(asyncssh is None, "asyncssh is not installed")
+class CreateSectorPagesAsyncTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.mkdtemp(prefix="sector-async-test-")
+        self.previous_directory = os.getcwd()
+        self.previous_path = os.environ["PATH"]
+        bin_directory = os.path.join(self.directory, "bin")
+        os.makedirs(bin_directory)
+        convert_path = os.path.join(bin_directory, "convert")
+        with open(convert_path, "w") as f:
+            f.write(COPY_CONVERT_SCRIPT)
+        os.chmod(convert_path, 0o755)
+        os.environ["PATH"] = f"{bin_directory}{os.pathsep}{self.previous_path}"
+        experts = generate_sector_data(self.directory, 12, image_size=None, image_kb=1)
+        # The scripts read and write relative to the working directory
+        os.chdir(self.directory)
+        self.wp_runner = FakeWPCommandRunner()
+        self.wp_runner.add_sector_templates()
+        for expert in experts:
+            self.wp_runner.add_user(slugify(expert), expert)
+        self.host = FakeWordPressHost(self.wp_runner)
+        port = await self.host.start()
+        self.runner = AsyncWPCommandRunner(
+            "127.0.0.1",
+            "ubuntu",
+            port,
+            connect_kwargs={"known_hosts": None, "client_keys": None},
+        )
+        await self.runner.connect()
+
+    async def asyncTearDown(self):
+        await self.runner.close()
+        await self.host.stop()
+        os.chdir(self.previous_directory)
+        os.environ["PATH"] = self.previous_path
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    async def sync(self, **kwargs):
+        # As in sectorpagecreator.py: the SectorManager makes blocking calls
+        # through a BlockingWPCommandRunner on the loop of the async runner
+        wp_runner = BlockingWPCommandRunner(self.runner, asyncio.get_running_loop())
+        with contextlib.redirect_stdout(io.StringIO()):
+            sector_manager = await asyncio.to_thread(
+                SectorManager,
+                wp_runner,
+                "redseer-sector-pages.csv",
+                "example.com",
+                **kwargs,
+            )
+            # A remote call made on the loop raises instead of blocking it
+            await asyncio.wait_for(sector_manager.create_sector_pages_async(4), 60)
+        return sector_manager
+
+    def get_pages(self):
+        return {
+            post["post_name"]: post_id
+            for post_id, post in self.wp_runner.posts.items()
+            if post["post_type"] == "page"
+        }
+
+    async def test_sync_creates_and_updates_every_page(self):
+        sector_manager = await self.sync()
+        pages = self.get_pages()
+        sectors = sector_manager.get_sectors_to_sync()
+        for sector in sectors:
+            self.assertIn("_elementor_data", self.wp_runner.meta[pages[sector.slug]])
+        self.assertEqual(
+            self.wp_runner.commands_by_type["wp post meta update"], len(sectors)
+        )
+        self.assertGreater(self.wp_runner.commands_by_type["wp media import"], 0)
+
+    async def test_incremental_sync_writes_nothing_when_nothing_changed(self):
+        await self.sync(incremental=True)
+        updates = self.wp_runner.commands_by_type["wp post meta update"]
+        sector_manager = await self.sync(incremental=True)
+        self.assertEqual(sector_manager.only_slugs, set())
+        self.assertEqual(
+            self.wp_runner.commands_by_type["wp post meta update"], updates
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,22 +1,192 @@
-from fabric import Connection
+import queue
+import threading
+from contextlib import contextmanager
+from instrumentation import tracer
+from sshpool import SSHConnectionPool
+from wpsession import WPSession, WPSessionError
+
+# Reads the queries from stdin, so their size is not bounded by ARG_MAX
+SQL_COMMAND = "wp db cli"
+# Subcommands that only read, so running them again has no effect
+READ_ONLY_SUBCOMMANDS = {"get", "list", "exists"}
+
+
+def get_command_type(command):
+    """
+    Short name of a remote command for statistics, e.g. "wp post meta update",
+    "wp db cli" or "mktemp". Arguments and options are left out.
+    """
+    if command.startswith("cd ") and " && " in command:
+        # Drop the cd into the WordPress directory
+        command = command.split(" && ", 1)[1]
+    # The last command of a pipeline is the one that does the work
+    words = command.split("|")[-1].split()
+    if not words:
+        return ""
+    if words[0] != "wp":
+        return words[0]
+    # wp <command> <subcommand>..., up to the first argument or option
+    name = []
+    for word in words[1:4]:
+        if (
+            not word[0].isalpha()
+            or not word.replace("-", "").replace("_", "").isalnum()
+        ):
+            break
+        name.append(word)
+    return " ".join(["wp"] + name)
+
+
+def get_sql_rows(output):
+    """
+    Rows of the output of a `wp db cli` query, as lists of columns. The
+    first line is the column header and is left out.
+    """
+    return [line.split("\t") for line in output.strip().split("\n")[1:] if line]
+
+
+def is_read_only(command):
+    """Check if a wp command only reads, e.g. `wp post meta get` or `wp user list`."""
+    words = get_command_type(command).split()
+    return len(words) > 1 and words[0] == "wp" and words[-1] in READ_ONLY_SUBCOMMANDS
 
 
 class WPCommandRunner:
-    def __init__(self, host, user, port=22, wp_path="/home/ubuntu/wordpress"):
+    def __init__(
+        self,
+        host,
+        user,
+        port=22,
+        wp_path="/home/ubuntu/wordpress",
+        use_session=False,
+        max_session_restarts=3,
+        pool_size=1,
+        max_channels=8,
+        keepalive=30,
+    ):
         self.wp_path = wp_path
-        self.connection = Connection(host=host, user=user, port=port)
+        # Commands run on channels leased from a pool of SSH connections, so
+        # concurrent callers share a few connections instead of one each.
+        self.pool = SSHConnectionPool(
+            host,
+            user,
+            port,
+            size=pool_size,
+            max_channels=max_channels,
+            keepalive=keepalive,
+        )
+        # When use_session is set, plain wp commands are sent to a persistent
+        # WP-CLI worker instead of bootstrapping WordPress for each of them.
+        # Up to pool_size workers are started, each used by one caller at a time.
+        self.use_session = use_session
+        self.max_sessions = max(1, pool_size)
+        self.sessions = []
+        self.idle_sessions = queue.Queue()
+        self.session_restarts_left = max_session_restarts
+        self.lock = threading.Lock()
+
+    @property
+    def connection(self):
+        return self.pool.connection
+
+    def run_command(self, command, stdin=None):
+        with tracer.span("remote", command_type=get_command_type(command)) as span:
+            stdout = self.pool.run(command, stdin=stdin).stdout.strip()
+            span["stdout_bytes"] = len(stdout)
+            return stdout
+
+    def put(self, local_path, remote_path):
+        with tracer.span("remote", command_type="put"):
+            self.pool.put(local_path, remote_path)
+
+    def stats(self):
+        stats = self.pool.stats()
+        stats["sessions"] = len(self.sessions)
+        return stats
+
+    @contextmanager
+    def lease_session(self):
+        try:
+            session = self.idle_sessions.get_nowait()
+        except queue.Empty:
+            session = None
+            with self.lock:
+                if len(self.sessions) < self.max_sessions:
+                    session = WPSession(self.pool, self.wp_path)
+                    self.sessions.append(session)
+            if session is None:
+                session = self.idle_sessions.get()
+        try:
+            yield session
+        finally:
+            self.idle_sessions.put(session)
+
+    def discard_session(self, session):
+        # Close a session that died or failed. It is started again on its
+        # next use, until we run out of restarts and stay with one-off
+        # commands.
+        session.close()
+        with self.lock:
+            if self.session_restarts_left <= 0:
+                if self.use_session:
+                    print("❌ WP-CLI session keeps failing, using one-off commands.")
+                self.use_session = False
+                return
+            self.session_restarts_left -= 1
+
+    def start_session(self, session):
+        # Start the session on first use, or after it was discarded
+        if session.alive:
+            return True
+        if session.channel is not None:
+            # The worker died since the last command
+            self.discard_session(session)
+        if not self.use_session:
+            return False
+        try:
+            session.start()
+        except Exception as e:
+            print(f"❌ Failed to start WP-CLI session: {e}")
+            self.use_session = False
+            session.close()
+            return False
+        return True
+
+    def run_wp_cli(self, command, stdin=None):
+        with tracer.span("remote", command_type=get_command_type(command)) as span:
+            stdout = self.run_wp_cli_command(command, stdin, span)
+            span["stdout_bytes"] = len(stdout)
+            return stdout
 
-    def run_command(self, command):
-        result = self.connection.run(command, hide=True)
-        return result.stdout.strip()
+    def run_sql_rows(self, sql):
+        """Run a query with `wp db cli` and return its rows, see get_sql_rows()."""
+        return get_sql_rows(self.run_wp_cli(SQL_COMMAND, stdin=sql.encode("utf-8")))
 
-    def run_wp_cli(self, command):
+    def run_wp_cli_command(self, command, stdin, span):
+        if self.use_session and stdin is None and WPSession.supports(command):
+            with self.lease_session() as session:
+                if self.start_session(session):
+                    try:
+                        span["session"] = True
+                        return session.run(command)
+                    except WPSessionError as e:
+                        # A late reply to this request would answer the next
+                        # one, so the session is never used again
+                        span["session"] = False
+                        self.discard_session(session)
+                        if e.sent and not is_read_only(command):
+                            # It may have run, running it again could create
+                            # a second page or attachment
+                            raise
+                        print(f"❌ {e}. Running command without the session.")
         # Connect to the server and change to the WordPress directory
         # Run the command from the WordPress installation directory or
         # wp cli will not work.
         wp_command = f"cd {self.wp_path} && {command}"
-        result = self.connection.run(wp_command, hide=True)
-        return result.stdout.strip()
+        return self.pool.run(wp_command, stdin=stdin).stdout.strip()
 
     def close(self):
-        self.connection.close()
+        for session in self.sessions:
+            if session.channel is not None:
+                session.close()
+        self.pool.close()
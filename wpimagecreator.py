@@ -1,85 +1,386 @@
 from wpcommandrunner import WPCommandRunner
+from imagecache import ImageCache
+from instrumentation import tracer
+from mediaindex import MediaIndex, get_upload_name
+from concurrent.futures import ProcessPoolExecutor
+from invoke.exceptions import UnexpectedExit
 import os
 import shlex
+import subprocess
+import threading
+
+OPTIMIZED_IMAGE_QUALITY = 90
+
+
+def optimize_image(
+    image_file_path, optimized_image_path, width, quality=OPTIMIZED_IMAGE_QUALITY
+):
+    """
+    Resize an image for the web with ImageMagick's convert. Runs in a worker
+    process during the optimization pre-pass.
+    Returns (optimized_image_path, exit code, error output).
+    """
+    try:
+        result = subprocess.run(
+            [
+                "convert",
+                image_file_path,
+                "-resize",
+                f"{width}x",
+                "-quality",
+                str(quality),
+                optimized_image_path,
+            ],
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError as e:
+        return optimized_image_path, 127, str(e)
+    if result.returncode != 0 and os.path.exists(optimized_image_path):
+        # Do not leave a partial file behind, it would be taken as optimized
+        os.remove(optimized_image_path)
+    return optimized_image_path, result.returncode, result.stderr.strip()
 
 
 class WPImageCreator:
-    def __init__(self, wp_command_runner: WPCommandRunner):
+    def __init__(
+        self,
+        wp_command_runner: WPCommandRunner,
+        image_cache=None,
+        lookup_only=False,
+        lookup_cache=None,
+    ):
         self.wp_runner = wp_command_runner
+        # In lookup only mode images are only looked up, nothing is optimized
+        # or uploaded. Images that are not on the server yet resolve to
+        # (None, None).
+        self.lookup_only = lookup_only
+        self.image_cache = image_cache if image_cache is not None else ImageCache()
+        self.media_index = MediaIndex(self.wp_runner, lookup_cache=lookup_cache)
+        # Images resolved in this run, by optimized image name. Pages that use
+        # the same image (and parallel workers) share one lookup and upload.
+        self.images = {}
+        self.image_locks = {}
+        self.lock = threading.Lock()
 
     def check_and_create_image(self, image_file_path, optimized_image_name, width):
+        with self.lock:
+            image_lock = self.image_locks.setdefault(
+                optimized_image_name, threading.Lock()
+            )
+        with image_lock:
+            tracer.cache("image_memo", optimized_image_name in self.images)
+            if optimized_image_name in self.images:
+                return self.images[optimized_image_name]
+            with tracer.span("image.create", image=optimized_image_name):
+                image_id, image_url = self.create_image(
+                    image_file_path, optimized_image_name, width
+                )
+            if image_id:
+                self.images[optimized_image_name] = (image_id, image_url)
+            return image_id, image_url
+
+    @staticmethod
+    def find_source_image(image_file_path):
         # Check if the image file exists locally - the image file path may be
         # .png or .jpg. Check for the existance of either of them.
-        jpgeg_and_png_file_paths = set(
-            [
-                image_file_path,
-                image_file_path.replace(".jpg", ".png"),
-                image_file_path.replace(".png", ".jpg"),
-            ]
-        )
-        image_file_path = None
+        jpgeg_and_png_file_paths = [
+            image_file_path,
+            image_file_path.replace(".jpg", ".png"),
+            image_file_path.replace(".png", ".jpg"),
+        ]
         for file_path in jpgeg_and_png_file_paths:
             if os.path.exists(file_path):
-                image_file_path = file_path
-                break
-        if not image_file_path:
+                return file_path
+        return None
+
+    def optimize_images(self, image_jobs, max_workers=None):
+        """
+        Create the optimized versions of many images up front, in a process
+        pool sized to the number of cores. image_jobs is a list of
+        (source image path, optimized image name, width). Images that are
+        already optimized are skipped, and the page loop then only has to
+        look them up or upload them.
+        """
+        pending = {}
+        for image_file_path, optimized_image_name, width in image_jobs:
+            source_path = self.find_source_image(image_file_path)
+            if not source_path:
+                continue
+            optimized_image_path = os.path.join(
+                os.path.dirname(source_path), optimized_image_name
+            )
+            key, needs_optimize, replaced = self.get_cache_state(
+                source_path, optimized_image_path, width
+            )
+            if needs_optimize:
+                pending[optimized_image_path] = (
+                    source_path,
+                    width,
+                    key,
+                    optimized_image_name,
+                    replaced,
+                )
+        if not pending:
+            return
+        max_workers = max_workers or os.cpu_count()
+        print(f"🛠️ Optimizing {len(pending)} images with {max_workers} workers...")
+        with tracer.span("image.optimize", images=len(pending)), ProcessPoolExecutor(
+            max_workers=max_workers
+        ) as executor:
+            futures = [
+                executor.submit(optimize_image, job[0], optimized_path, job[1])
+                for optimized_path, job in pending.items()
+            ]
+            for future in futures:
+                optimized_image_path, returncode, error = future.result()
+                if returncode != 0:
+                    print(
+                        f"❌ Failed to optimize image {optimized_image_path} (exit code {returncode}): {error}"
+                    )
+                    continue
+                _, _, key, optimized_image_name, replaced = pending[
+                    optimized_image_path
+                ]
+                self.image_cache.put(
+                    key, optimized_image_path, optimized_image_name, replaced=replaced
+                )
+        print("✅ Image optimization done.")
+
+    def get_cache_state(self, source_path, optimized_image_path, width):
+        """
+        Look up an image in the optimized image cache, and its attachment in
+        the host's lookup cache. Returns (key, needs_optimize, replaced),
+        where replaced means the attachment of the image on the host, if
+        there is one, was not made from the current source.
+        """
+        image_name = os.path.basename(optimized_image_path)
+        key = self.image_cache.get_key(
+            source_path, width, OPTIMIZED_IMAGE_QUALITY, image_name
+        )
+        entry = self.image_cache.get(key)
+        exists = os.path.exists(optimized_image_path)
+        if entry and entry["optimized_path"] == optimized_image_path:
+            needs_optimize = not exists
+            replaced = entry.get("replaced", False)
+        else:
+            previous_key, _ = self.image_cache.find_by_optimized_path(
+                optimized_image_path
+            )
+            # Optimized files from before the cache are trusted unless their
+            # source was modified after them
+            replaced = (previous_key is not None and previous_key != key) or (
+                exists
+                and os.path.getmtime(source_path)
+                > os.path.getmtime(optimized_image_path)
+            )
+            needs_optimize = not exists or replaced
+        uploaded_key = self.media_index.get_source(image_name)
+        if uploaded_key is not None:
+            # The host's attachment was made by us, from a known source
+            replaced = uploaded_key != key
+            if not replaced and self.media_index.get_cached(image_name):
+                # Already uploaded, the local file is not needed any more
+                needs_optimize = False
+        return key, needs_optimize, replaced
+
+    def create_image(self, image_file_path, optimized_image_name, width):
+        source_path = self.find_source_image(image_file_path)
+        if not source_path:
             print(f"❌ Image file {image_file_path} does not exist locally.")
             return None, None
+        image_file_path = source_path
         # The source image file exists. Check if the optimized image exists locally.
         # Check if the optimized image already exists in the same directory as the original image
         optimized_image_path = os.path.join(
             os.path.dirname(image_file_path), optimized_image_name
         )
-        if not os.path.exists(optimized_image_path):
-            # The optimized image does not exist. We need to create it. Use convert (ImageMagick)
+        key, needs_optimize, replaced = self.get_cache_state(
+            image_file_path, optimized_image_path, width
+        )
+        tracer.cache("image_cache", not needs_optimize)
+        if not replaced:
+            # Check if the image file exists in the WordPress media library
+            image_id, image_url = self.get_wp_image_id_and_url(optimized_image_name)
+            if image_id:
+                self.media_index.set_source(optimized_image_name, key)
+                print(f"✅ Image {optimized_image_name} found with ID {image_id}.")
+                return image_id, image_url
+        if self.lookup_only:
+            print(f"⏸️ Image {optimized_image_name} is not uploaded yet.")
+            return None, None
+        if needs_optimize or not os.path.exists(optimized_image_path):
+            # The optimized image does not exist or is out of date. We need to create it. Use convert (ImageMagick)
             print("🛠️ Optimizing image for web...")
-            os.system(
-                f"convert {shlex.quote(image_file_path)} -resize {width}x -quality 90 {shlex.quote(optimized_image_path)}"
+            _, returncode, error = optimize_image(
+                image_file_path, optimized_image_path, width
             )
-            print(f"🛠️ Optimized image created: {optimized_image_name}")
-            if not os.path.exists(optimized_image_path):
+            if returncode != 0 or not os.path.exists(optimized_image_path):
                 print(
-                    f"❌ Failed to create optimized image {optimized_image_name}. Please check the ImageMagick installation."
+                    f"❌ Failed to create optimized image {optimized_image_name} (exit code {returncode}): {error}. Please check the ImageMagick installation."
                 )
                 return None, None
-        # Check if the image file exists in the WordPress media library
-        image_id, image_url = self.get_wp_image_id_and_url(optimized_image_name)
-        if not image_id:
+            print(f"🛠️ Optimized image created: {optimized_image_name}")
+            self.image_cache.put(
+                key, optimized_image_path, optimized_image_name, replaced=replaced
+            )
+        if replaced:
+            print(f"🔄 Image {optimized_image_name} changed, uploading it again.")
+        else:
             print(
                 f"❌ Image {optimized_image_name} not found in WordPress media library."
             )
-            self.upload_image(optimized_image_path, optimized_image_name)
-            image_id, image_url = self.get_wp_image_id_and_url(optimized_image_name)
-            if not image_id:
-                print(
-                    f"❌ Failed to upload image {optimized_image_name} to WordPress media library."
-                )
-                return None, None
+        image_id, image_url = self.upload_image(
+            optimized_image_path, optimized_image_name
+        )
+        if not image_id or not image_url:
+            print(
+                f"❌ Failed to upload image {optimized_image_name} to WordPress media library."
+            )
+            return None, None
+        self.media_index.set_source(optimized_image_name, key)
         print(f"✅ Image {optimized_image_name} found with ID {image_id}.")
         return image_id, image_url
 
     def upload_image(self, image_file_path, image_file_name):
-        # Use fabric to get the image file to the server
-        print(f"🛠️ Uploading image {image_file_name} to WordPress media library...")
-        remote_path = f"/tmp/{image_file_name}"
-        self.wp_runner.connection.put(image_file_path, remote_path)
-        print(f"🔄 Uploaded {image_file_path} to {remote_path}")
-        # Now run the wp media import command to upload the image
-        command = f"wp media import {remote_path} --porcelain"
-        output = self.wp_runner.run_wp_cli(command)
-        if output:
-            print(f"✅ Image {image_file_name} uploaded successfully with ID {output}.")
+        image_id, image_url = self.upload_images(
+            [(image_file_path, image_file_name)]
+        ).get(image_file_name, (None, None))
+        return image_id, image_url
+
+    def upload_images(self, images):
+        """
+        Upload many images to the media library at once. images is a list of
+        (local path, file name). All files go over one SFTP session into a
+        temporary directory on the server, are imported with a single
+        `wp media import`, and the directory is removed afterwards.
+        Returns a dict of file name -> (attachment ID, URL path).
+        """
+        if not images:
+            return {}
+        with tracer.span("image.upload", images=len(images)):
+            uploaded = self.upload_images_in_batch(images)
+        return uploaded
+
+    def upload_images_in_batch(self, images):
+        print(f"🛠️ Uploading {len(images)} images to WordPress media library...")
+        remote_directory = self.wp_runner.run_command(
+            "mktemp -d /tmp/wp-media-import-XXXXXX"
+        )
+        try:
+            remote_paths = []
+            for image_file_path, image_file_name in images:
+                remote_path = f"{remote_directory}/{image_file_name}"
+                self.wp_runner.put(image_file_path, remote_path)
+                remote_paths.append(remote_path)
+            print(f"🔄 Uploaded {len(images)} images to {remote_directory}")
+            # Now run the wp media import command to import all the images.
+            # It prints the ID of every imported image, in order.
+            command = "wp media import {} --porcelain".format(
+                " ".join(shlex.quote(path) for path in remote_paths)
+            )
+            try:
+                output = self.wp_runner.run_wp_cli(command)
+            except UnexpectedExit as e:
+                # Some of the images failed, keep the ones that were imported
+                print(f"❌ Failed to import some images: {e.result.stderr.strip()}")
+                output = e.result.stdout.strip()
+        finally:
+            self.wp_runner.run_command(f"rm -rf {shlex.quote(remote_directory)}")
+        image_ids = [line.strip() for line in output.split("\n") if line.strip()]
+        image_urls = self.get_wp_image_urls(image_ids)
+        uploaded = {}
+        if len(image_ids) == len(images):
+            for (_, image_file_name), image_id in zip(images, image_ids):
+                uploaded[image_file_name] = (image_id, image_urls.get(image_id))
         else:
-            print(
-                f"❌ Failed to upload image {image_file_name} to WordPress media library."
+            # Without an ID for every file the order can not be trusted, so
+            # match the attachments by file name. WordPress adds a suffix
+            # (name-1.jpg) when the name is taken.
+            for image_id, image_url in image_urls.items():
+                attached_name = get_upload_name(os.path.basename(image_url))
+                for _, image_file_name in images:
+                    if attached_name == image_file_name:
+                        uploaded[image_file_name] = (image_id, image_url)
+        for image_file_name, (image_id, image_url) in uploaded.items():
+            if image_url:
+                self.media_index.add(image_id, image_url, image_file_name)
+                print(
+                    f"✅ Image {image_file_name} uploaded successfully with ID {image_id}."
+                )
+        for _, image_file_name in images:
+            if image_file_name not in uploaded:
+                print(
+                    f"❌ Failed to upload image {image_file_name} to WordPress media library."
+                )
+        return uploaded
+
+    def upload_missing_images(self, image_jobs):
+        """
+        Upload every optimized image of image_jobs that is not in the media
+        library yet, in one batch, and record the sources they were made from.
+        """
+        missing = self.find_missing_images(image_jobs)
+        uploaded = self.upload_images(
+            [(path, name) for name, (_, path) in missing.items()]
+        )
+        for optimized_image_name, (image_id, image_url) in uploaded.items():
+            key, _ = missing[optimized_image_name]
+            if image_id and image_url:
+                self.media_index.set_source(optimized_image_name, key)
+
+    def find_missing_images(self, image_jobs, optimized=True):
+        """
+        Find the optimized images of image_jobs that have to be uploaded.
+        Images found in the media library have their source recorded.
+        Without optimized, the images are not expected to be optimized yet.
+        Returns a dict of optimized image name -> (cache key, optimized path).
+        """
+        missing = {}
+        for image_file_path, optimized_image_name, width in image_jobs:
+            source_path = self.find_source_image(image_file_path)
+            if not source_path:
+                continue
+            optimized_image_path = os.path.join(
+                os.path.dirname(source_path), optimized_image_name
             )
-        return output
+            key, needs_optimize, replaced = self.get_cache_state(
+                source_path, optimized_image_path, width
+            )
+            if not replaced:
+                image_id, _ = self.get_wp_image_id_and_url(optimized_image_name)
+                if image_id:
+                    self.media_index.set_source(optimized_image_name, key)
+                    continue
+            if needs_optimize and optimized:
+                # The optimization failed
+                continue
+            missing[optimized_image_name] = (key, optimized_image_path)
+        return missing
+
+    def prepare_images(self, image_jobs, max_workers=None):
+        """Optimize all images of a run in parallel, then upload the new ones in one batch."""
+        self.optimize_images(image_jobs, max_workers)
+        if not self.lookup_only:
+            self.upload_missing_images(image_jobs)
+        self.image_cache.save()
 
     def get_wp_image_id_and_url(self, image_file_name):
-        # Get the URL of an image uploaded to the WordPress media library
-        command = f"""echo "select post_id, meta_value from wppj_postmeta where meta_key='_wp_attached_file' and meta_value like '%{image_file_name}';" | wp db cli"""
-        output = self.wp_runner.run_wp_cli(command).strip()
-        if output:
-            image_id, image_url = output.split("\n")[-1].strip().split()
-            return image_id, image_url
-        return None, None
+        # Get the ID and URL of an image uploaded to the WordPress media library.
+        # All attachments are loaded once into the media index.
+        return self.media_index.get(image_file_name)
+
+    def get_wp_image_urls(self, image_ids):
+        # Get the paths (relative to wp-content/uploads) of many attachments
+        # in one query. Returns a dict of attachment ID -> path.
+        if not image_ids:
+            return {}
+        id_list = ",".join(str(int(image_id)) for image_id in image_ids)
+        rows = self.wp_runner.run_sql_rows(
+            f"select post_id, meta_value from wppj_postmeta where meta_key='_wp_attached_file' and post_id in ({id_list});"
+        )
+        image_urls = {}
+        for row in rows:
+            if len(row) == 2:
+                image_urls[row[0]] = row[1]
+        return image_urls
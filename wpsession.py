@@ -0,0 +1,162 @@
+import io
+import json
+import shlex
+import uuid
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result
+
+# PHP worker that is run with `wp eval-file`. WordPress is bootstrapped once
+# for the eval-file command, then every request read from STDIN is run in
+# the same process with WP_CLI::runcommand().
+# Requests and responses are newline delimited JSON:
+#   {"id": 1, "command": "post meta get 12 _elementor_data"}
+#   {"id": 1, "stdout": "...", "stderr": "...", "return_code": 0}
+SESSION_SCRIPT = r"""<?php
+while ( false !== ( $line = fgets( STDIN ) ) ) {
+	$request = json_decode( $line, true );
+	if ( ! is_array( $request ) || ! isset( $request['command'] ) ) {
+		continue;
+	}
+	$result = WP_CLI::runcommand(
+		$request['command'],
+		array(
+			'launch'     => false,
+			'exit_error' => false,
+			'return'     => 'all',
+			'parse'      => false,
+		)
+	);
+	fwrite(
+		STDOUT,
+		json_encode(
+			array(
+				'id'          => $request['id'],
+				'stdout'      => $result->stdout,
+				'stderr'      => $result->stderr,
+				'return_code' => $result->return_code,
+			)
+		) . "\n"
+	);
+	fflush( STDOUT );
+}
+"""
+
+# Tokens that need a real shell. Commands containing them are run one-off.
+SHELL_OPERATORS = {"|", "||", "&", "&&", ";", "<", ">", ">>", "<<", "(", ")"}
+
+
+class WPSessionError(Exception):
+    """
+    Raised when the session process has died or sent a bad response.
+    sent tells if the request may have reached the worker, in which case it
+    may have run.
+    """
+
+    def __init__(self, message, sent=True):
+        super().__init__(message)
+        self.sent = sent
+
+
+class WPSession:
+    """
+    A long lived WP-CLI worker on the remote host.
+
+    WordPress is loaded once and then each command is sent to the worker over
+    the channel's stdin, saving the WordPress bootstrap on every call. Only
+    plain `wp ...` commands can be run this way, see supports().
+    """
+
+    def __init__(self, pool, wp_path, timeout=300):
+        self.pool = pool
+        self.wp_path = wp_path
+        self.timeout = timeout
+        self.script_path = f"/tmp/wpcli-session-{uuid.uuid4().hex}.php"
+        self.channel = None
+        self.stdin = None
+        self.stdout = None
+        self.request_id = 0
+
+    @staticmethod
+    def supports(command):
+        """Check if the command is a single wp command without shell syntax."""
+        if not command.startswith("wp ") or "`" in command or "$(" in command:
+            return False
+        lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+        lexer.whitespace_split = True
+        try:
+            tokens = list(lexer)
+        except ValueError:
+            return False
+        return not any(token in SHELL_OPERATORS for token in tokens)
+
+    @property
+    def alive(self):
+        return (
+            self.channel is not None
+            and not self.channel.closed
+            and not self.channel.exit_status_ready()
+        )
+
+    def start(self):
+        print("🔌 Starting persistent WP-CLI session...")
+        self.pool.put(io.BytesIO(SESSION_SCRIPT.encode("utf-8")), self.script_path)
+        # The worker holds on to its channel until the session is closed
+        self.channel = self.pool.open_channel()
+        self.channel.settimeout(self.timeout)
+        # PHP notices go to a log file so that a full stderr window can never
+        # block the worker.
+        self.channel.exec_command(
+            f"cd {self.wp_path} && wp eval-file {self.script_path} "
+            f"2>> {self.script_path}.log"
+        )
+        self.stdin = self.channel.makefile_stdin("wb")
+        self.stdout = self.channel.makefile("rb")
+
+    def run(self, command):
+        if not self.alive:
+            raise WPSessionError("WP-CLI session is not running", sent=False)
+        self.request_id += 1
+        request = {"id": self.request_id, "command": command[len("wp ") :]}
+        try:
+            self.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+            self.stdin.flush()
+            line = self.stdout.readline()
+        except (OSError, EOFError) as e:
+            raise WPSessionError(f"WP-CLI session failed: {e}") from e
+        if not line:
+            raise WPSessionError("WP-CLI session closed unexpectedly")
+        try:
+            response = json.loads(line)
+        except ValueError as e:
+            raise WPSessionError(
+                f"Invalid response from WP-CLI session: {line!r}"
+            ) from e
+        if response.get("id") != self.request_id:
+            raise WPSessionError(
+                f"Out of order response from WP-CLI session: {response.get('id')}"
+            )
+        if response["return_code"] != 0:
+            # Fail the same way a one-off fabric command does
+            raise UnexpectedExit(
+                Result(
+                    stdout=response["stdout"],
+                    stderr=response["stderr"],
+                    command=command,
+                    exited=response["return_code"],
+                    hide=("stdout", "stderr"),
+                )
+            )
+        return response["stdout"].strip()
+
+    def close(self):
+        if self.channel is not None:
+            try:
+                self.channel.shutdown_write()
+            except OSError:
+                pass
+            self.pool.close_channel(self.channel)
+            self.channel = None
+        try:
+            self.pool.run(f"rm -f {self.script_path} {self.script_path}.log", warn=True)
+        except Exception as e:
+            print(f"❌ Failed to remove WP-CLI session script: {e}")